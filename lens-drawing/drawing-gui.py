@@ -17,6 +17,7 @@
 """
 # -*- coding: utf-8 -*
 import sys
+import time
 import numpy as np
 from PyQt5 import QtCore, QtGui, QtWidgets
 from gui import Ui_MainWindow
@@ -27,10 +28,15 @@ from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as Navigatio
 from matplotlib.figure import Figure
 from lens import Lens
 import surface as s
-import json
+import lensfile
 
 
 class MplCanvas(FigureCanvas):
+
+	line_names = ('curve1', 'flat1_upper', 'flat1_lower',
+				  'curve2', 'flat2_upper', 'flat2_lower',
+				  'edge_upper', 'edge_lower')
+
 	def __init__(self, parent=None, width=10, height=10, dpi=100):
 		fig = Figure(dpi=dpi)
 		self.axes = fig.add_subplot(111)
@@ -42,6 +48,170 @@ class MplCanvas(FigureCanvas):
 		FigureCanvas.setSizePolicy(self,QtWidgets.QSizePolicy.Fixed,QtWidgets.QSizePolicy.Fixed)
 		FigureCanvas.updateGeometry(self)
 
+		# the lines of the lens are created once and only get new data
+		self.lines = {}
+		for name in self.line_names:
+			self.lines[name], = self.axes.plot([], [], 'b')
+		self.limit = None
+
+	def setLines(self, data):
+		"""
+		Updates the lines and repaints once
+
+		Args:
+			data(dict): line name -> (x, y), lines not given are hidden
+		"""
+		for name, line in self.lines.items():
+			if name in data:
+				line.set_data(*data[name])
+				line.set_visible(True)
+			else:
+				line.set_visible(False)
+		self.draw_idle()
+
+	def setLimit(self, limit):
+		"""
+		Sets both axes to [-limit, limit], only if it changed
+		"""
+		if limit == self.limit:
+			return
+		self.axes.set_xlim([-limit, limit])
+		self.axes.set_ylim([-limit, limit])
+		self.limit = limit
+
+
+def computeDrawing(lens, is_current=lambda: True):
+	"""
+	Evaluates everything shown for a lens, safe to run in a worker thread
+
+	Args:
+		lens(Lens): lens object to be drawn
+		is_current: returns False once the result is no longer wanted
+
+	Returns:
+		dict of 'volume', 'lines' and 'limit' for the canvas and 'tables'
+		of (h, sag, slope, local_R) arrays per surface, or only 'message'
+		if the lens cannot be drawn; None if cancelled
+	"""
+	if lens.left.inner_d <= 0.0 or lens.right.inner_d <= 0.0:
+		return {'message': ''}
+
+	if (lens.left.inner_d/2 > lens.left.max_semi_aperture() or
+			lens.right.inner_d/2 > lens.right.max_semi_aperture()):
+		return {'message': "Inner diameter exceeds the valid aperture of the surface"}
+
+	step = 0.25
+	tolerance = 0.001
+	lines = {}
+	tables = []
+
+	for i, (surf, offset) in enumerate(((lens.left, 0.0), (lens.right, lens.thickness)), 1):
+		if not is_current():
+			return None
+
+		# curve
+		h = surf.sample(-surf.inner_d/2, surf.inner_d/2, tolerance)
+		z = s.evaluation_cache.sag(surf, h) + offset
+		lines['curve{}'.format(i)] = (z, h)
+
+		# plane
+		ha = np.array([surf.inner_d/2, surf.outer_d/2])
+		za = np.zeros_like(ha) + z[-1]
+		lines['flat{}_upper'.format(i)] = (za, ha)
+		lines['flat{}_lower'.format(i)] = (za, -ha)
+
+		# data
+		hp = np.arange(0.0, surf.inner_d/2, step)
+		tables.append((hp,) + tuple(s.evaluation_cache.profile(surf, hp)))
+
+	# edge
+	z3 = np.array([lines['curve1'][0][0], lines['curve2'][0][0]], dtype=float)
+	h3 = np.array([lens.left.outer_d/2, lens.right.outer_d/2], dtype=float)
+	lines['edge_upper'] = (z3, h3)
+	lines['edge_lower'] = (z3, -h3)
+
+	if not is_current():
+		return None
+
+	# axis scale
+	margin = 1.0
+	max_d = np.maximum(lens.left.outer_d/2, lens.right.outer_d/2)
+	limit = float(np.maximum(max_d, lens.thickness) + margin)
+
+	return {'volume': lens.volume, 'lines': lines, 'limit': limit, 'tables': tables}
+
+
+class ProfileTableModel(QtCore.QAbstractTableModel):
+	"""
+	Table of h, sag, slope and local_R backed by the result arrays
+
+	Cells are formatted when the view asks for them, so only the visible
+	rows cost anything beyond the arrays themselves.
+	"""
+
+	header_labels = ['h', 'sag', 'slope', 'local_R']
+
+	def __init__(self, parent=None):
+		super(ProfileTableModel, self).__init__(parent)
+		self.columns = ()
+		self.rows = 0
+
+	def setColumns(self, columns):
+		"""
+		Replaces the data by a sequence of equally long arrays, one per column
+		"""
+		self.beginResetModel()
+		self.columns = tuple(columns)
+		self.rows = len(self.columns[0]) if self.columns else 0
+		self.endResetModel()
+
+	def rowCount(self, parent=QtCore.QModelIndex()):
+		if parent.isValid():
+			return 0
+		return self.rows
+
+	def columnCount(self, parent=QtCore.QModelIndex()):
+		if parent.isValid():
+			return 0
+		return len(self.header_labels)
+
+	def data(self, index, role=QtCore.Qt.DisplayRole):
+		if role != QtCore.Qt.DisplayRole or not index.isValid():
+			return None
+		return '{:.4f}'.format(self.columns[index.column()][index.row()])
+
+	def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+		if role != QtCore.Qt.DisplayRole:
+			return None
+		if orientation == QtCore.Qt.Horizontal:
+			return self.header_labels[section]
+		return str(section + 1)
+
+
+class DrawSignals(QtCore.QObject):
+	finished = QtCore.pyqtSignal(int, object)
+
+
+class DrawWorker(QtCore.QRunnable):
+	"""
+	Runs computeDrawing() in a thread pool
+
+	finished is emitted with the revision and the result, None if the
+	revision became outdated before the work was done.
+	"""
+	def __init__(self, lens, revision, is_current):
+		super(DrawWorker, self).__init__()
+		self.lens = lens
+		self.revision = revision
+		self.is_current = is_current
+		self.signals = DrawSignals()
+
+	def run(self):
+		result = None
+		if self.is_current():
+			result = computeDrawing(self.lens, self.is_current)
+		self.signals.finished.emit(self.revision, result)
+
 
 class Window(QtWidgets.QMainWindow):
 	def __init__(self, parent=None):
@@ -55,6 +225,11 @@ class Window(QtWidgets.QMainWindow):
 		self.initializeCoefTable('left')
 		self.initializeCoefTable('right')
 
+		# data tables
+		for which_surf in ('left', 'right'):
+			data_view = self.getUiObjects(which_surf)[4]
+			data_view.setModel(ProfileTableModel(data_view))
+
 		# lens list
 		self.lens_list = []
 
@@ -64,6 +239,7 @@ class Window(QtWidgets.QMainWindow):
 		self.ui.lineEdit_R1_Diameter_Outer.setValidator(QtGui.QDoubleValidator())
 		self.ui.lineEdit_R2_Diameter_Inner.setValidator(QtGui.QDoubleValidator())
 		self.ui.lineEdit_R2_Diameter_Outer.setValidator(QtGui.QDoubleValidator())
+		self.ui.lineEdit_Volume.setReadOnly(True)
 		
 		# draw area
 		self.l = QtWidgets.QVBoxLayout(self.ui.tab_Draw)
@@ -71,6 +247,22 @@ class Window(QtWidgets.QMainWindow):
 		self.l.addWidget(self.sc)
 		self.l.addWidget(NavigationToolbar(self.sc,self))
 
+		# edits are drawn once they pause, a burst of them costs one redraw
+		self.redrawTimer = QtCore.QTimer(self)
+		self.redrawTimer.setSingleShot(True)
+		self.redrawTimer.setInterval(150)
+		self.redrawTimer.timeout.connect(self.updateDrawing)
+		self.pendingRow = -1
+
+		# evaluation runs in the background, results of older revisions are dropped
+		self.pool = QtCore.QThreadPool(self)
+		self.pool.setMaxThreadCount(1)
+		self.revision = 0
+		self.workers = {}
+
+		# lens file being read, lenses are added between events
+		self.loading = None
+
 		# signals & slots
 		self.ui.pushButton_AddLens.clicked.connect(lambda: self.addNewLens())
 		self.ui.pushButton_DeleteLens.clicked.connect(self.deleteSelectedLens)
@@ -104,16 +296,16 @@ class Window(QtWidgets.QMainWindow):
 			pass
 
 		try:
-			self.ui.tableWidget_R1_Coefs.cellChanged.connect(self.updateDrawing)
+			self.ui.tableWidget_R1_Coefs.cellChanged.connect(self.scheduleDrawing)
 		except ConnectionError:
 			pass
 		try:
-			self.ui.tableWidget_R2_Coefs.cellChanged.connect(self.updateDrawing)
+			self.ui.tableWidget_R2_Coefs.cellChanged.connect(self.scheduleDrawing)
 		except ConnectionError:
 			pass
 
 		try:
-			self.ui.lineEdit_Thickness.textEdited.connect(self.updateDrawing)
+			self.ui.lineEdit_Thickness.textEdited.connect(self.scheduleDrawing)
 		except ConnectionError:
 			pass
 
@@ -123,19 +315,19 @@ class Window(QtWidgets.QMainWindow):
 			pass
 
 		try:
-			self.ui.lineEdit_R1_Diameter_Inner.textEdited.connect(self.updateDrawing)
+			self.ui.lineEdit_R1_Diameter_Inner.textEdited.connect(self.scheduleDrawing)
 		except ConnectionError:
 			pass
 		try:
-			self.ui.lineEdit_R1_Diameter_Outer.textEdited.connect(self.updateDrawing)
+			self.ui.lineEdit_R1_Diameter_Outer.textEdited.connect(self.scheduleDrawing)
 		except ConnectionError:
 			pass
 		try:
-			self.ui.lineEdit_R2_Diameter_Inner.textEdited.connect(self.updateDrawing)
+			self.ui.lineEdit_R2_Diameter_Inner.textEdited.connect(self.scheduleDrawing)
 		except ConnectionError:
 			pass
 		try:
-			self.ui.lineEdit_R2_Diameter_Outer.textEdited.connect(self.updateDrawing)
+			self.ui.lineEdit_R2_Diameter_Outer.textEdited.connect(self.scheduleDrawing)
 		except ConnectionError:
 			pass
 
@@ -194,9 +386,9 @@ class Window(QtWidgets.QMainWindow):
 
 	def getUiObjects(self, which_surf= 'left'):
 		if which_surf == 'left':
-			return self.ui.lineEdit_R1_Diameter_Outer, self.ui.lineEdit_R1_Diameter_Inner, self.ui.comboBox_R1_Type, self.ui.tableWidget_R1_Coefs, self.ui.tableWidget_R1_Data
+			return self.ui.lineEdit_R1_Diameter_Outer, self.ui.lineEdit_R1_Diameter_Inner, self.ui.comboBox_R1_Type, self.ui.tableWidget_R1_Coefs, self.ui.tableView_R1_Data
 		else:
-			return self.ui.lineEdit_R2_Diameter_Outer, self.ui.lineEdit_R2_Diameter_Inner, self.ui.comboBox_R2_Type, self.ui.tableWidget_R2_Coefs, self.ui.tableWidget_R2_Data
+			return self.ui.lineEdit_R2_Diameter_Outer, self.ui.lineEdit_R2_Diameter_Inner, self.ui.comboBox_R2_Type, self.ui.tableWidget_R2_Coefs, self.ui.tableView_R2_Data
 
 
 	def initializeCoefTable(self, which_surf= 'left'):
@@ -266,6 +458,8 @@ class Window(QtWidgets.QMainWindow):
 		Delete the selected lens from the list
 		"""
 
+		self.commitPendingEdit()
+
 		index = self.ui.listWidget_Lens.currentIndex().row()
 		if index >= 0:
 			self.ui.listWidget_Lens.takeItem(index)
@@ -279,6 +473,9 @@ class Window(QtWidgets.QMainWindow):
 		Slot function connected to selection change of listWidget
 		"""
 
+		# the fields still show the previous lens
+		self.commitPendingEdit()
+
 		lens = self.lens_list[self.ui.listWidget_Lens.currentRow()]
 		self.setLensToUI(lens)
 		self.updateDrawing()
@@ -303,16 +500,26 @@ class Window(QtWidgets.QMainWindow):
 		edit_outer, edit_inner, combo, coef_table, _ = self.getUiObjects(which_surf)
 
 		type_index = combo.currentIndex()
+
+		# diameters
+		try:
+			outer_d = float(edit_outer.text())
+		except ValueError:
+			outer_d = 0.0
+		
+		try:
+			inner_d = float(edit_inner.text())
+		except ValueError:
+			inner_d = 0.0
 		
 		if type_index == 0: # sphere
-			surf = s.Sphere()
 			r = np.inf
 			try:
 				r = float(coef_table.item(0,0).text())
 			except ValueError:
 				r = np.inf
 
-			surf.r = r
+			surf = s.Sphere(r, inner_d, outer_d)
 
 		else:
 			r = np.inf
@@ -339,21 +546,9 @@ class Window(QtWidgets.QMainWindow):
 					coefs[i-2] = 0.0
 
 			if type_index == 1:
-				surf = s.EvenAsphere(r,k,coefs)
+				surf = s.EvenAsphere(r,k,coefs,inner_d,outer_d)
 			else:
-				surf = s.OddAsphere(r,k,coefs)
-				
-		
-		# diameters
-		try:
-			surf.outer_d = float(edit_outer.text())
-		except ValueError:
-			surf.outer_d = 0.0
-		
-		try:
-			surf.inner_d = float(edit_inner.text())
-		except ValueError:
-			surf.inner_d = 0.0
+				surf = s.OddAsphere(r,k,coefs,inner_d,outer_d)
 
 		return surf
 	
@@ -375,7 +570,7 @@ class Window(QtWidgets.QMainWindow):
 			except AttributeError:
 				pass
 		else:
-			combo.setCurrentIndex(1)
+			combo.setCurrentIndex(s.SurfaceBatch.types.index(surf.type))
 			self.disconnectAll()
 			self.initializeCoefTable(which_surf)
 			r,k,coefs = surf.get_parameters()
@@ -394,14 +589,20 @@ class Window(QtWidgets.QMainWindow):
 
 		self.connectAll()
 
-	def getLensFromUI(self):
+	def getLensFromUI(self, row=None):
 		"""
 		Get lens parameters from UI
+
+		Args:
+			row(int): row of the lens in the list, the current row if None
 		"""
 
 		# lens name
 		lens = Lens()
-		lens.name = self.ui.listWidget_Lens.currentItem().text()
+		if row is None:
+			lens.name = self.ui.listWidget_Lens.currentItem().text()
+		else:
+			lens.name = self.ui.listWidget_Lens.item(row).text()
 		
 		# both surface
 		lens.left  = self.getSurfaceFromUI('left')
@@ -442,119 +643,86 @@ class Window(QtWidgets.QMainWindow):
 		"""
 		Draws the lens schematic
 
+		The evaluation runs in the thread pool and the result is shown by
+		showDrawing() once it arrives, unless a newer lens was drawn since.
+
 		Args:
 			lens(Lens): lens object to be drawn
 		"""
 
-		self.sc.axes.clear()
-		self.sc.draw()
-		self.ui.tableWidget_R1_Data.clear()
-		self.ui.tableWidget_R2_Data.clear()
-
-
+		self.revision += 1
 		if lens is None:
+			self.showDrawing(self.revision, {'message': ''})
 			return
 
-		if lens.left.inner_d <= 0.0 or lens.right.inner_d <= 0.0:
-			#print("Invalid diameter (<=0)")
-			return
-		
-
-		header_labels = ['h', 'sag', 'slope', 'local_R']
-		step = 0.25
-		color = 'b'
-
-		# --------------
-		# left surface
-		# --------------
+		revision = self.revision
+		worker = DrawWorker(lens, revision, lambda: revision == self.revision)
+		worker.signals.finished.connect(self.showDrawing)
+		self.workers[revision] = worker
+		self.pool.start(worker)
 
-		# curve
-		h1 = np.linspace(-lens.left.inner_d/2, lens.left.inner_d/2)
-		z1 = lens.left.sag(h1)
-		self.sc.axes.plot(z1, h1, color)
-
-		# plane
-		h1a = np.linspace(lens.left.inner_d/2, lens.left.outer_d/2)
-		z1a = np.zeros_like(h1a) + z1[-1]
-		self.sc.axes.plot(z1a, h1a, color)
-		self.sc.axes.plot(z1a, -h1a, color)
+	def showDrawing(self, revision, result):
+		"""
+		Shows the result of computeDrawing() on the main thread
+		"""
+		self.workers.pop(revision, None)
+		if revision != self.revision or result is None:
+			# outdated by a newer edit
+			return
 
-		# data
-		h1p = np.arange(0.0, lens.left.inner_d/2, step)
-		sag1 = lens.left.sag(h1p)
-		slope1 = lens.left.slope(h1p)
-		localR1 = lens.left.local_radius(h1p)
-
-		table = self.ui.tableWidget_R1_Data
-		table.clear()
-		table.setColumnCount(len(header_labels))
-		table.setHorizontalHeaderLabels(header_labels)
-		table.setRowCount(len(h1p))
-
-		for i in range(len(h1p)):
-			table.setItem(i,0, QtWidgets.QTableWidgetItem('{:.4f}'.format(h1p[i])))
-			table.setItem(i,1, QtWidgets.QTableWidgetItem('{:.4f}'.format(sag1[i])))
-			table.setItem(i,2, QtWidgets.QTableWidgetItem('{:.4f}'.format(slope1[i])))
-			table.setItem(i,3, QtWidgets.QTableWidgetItem('{:.4f}'.format(localR1[i])))
-
-		# ---------------
-		# right surface
-		# ---------------
+		views = (self.ui.tableView_R1_Data, self.ui.tableView_R2_Data)
+		self.ui.lineEdit_Volume.clear()
+		self.ui.statusbar.clearMessage()
 
-		# curve
-		h2 = np.linspace(-lens.right.inner_d/2, lens.right.inner_d/2)
-		z2 = lens.right.sag(h2) + lens.thickness
-		self.sc.axes.plot(z2, h2, color)
+		if 'message' in result:
+			self.sc.setLines({})
+			for view in views:
+				view.model().setColumns(())
+			if result['message']:
+				self.ui.statusbar.showMessage(result['message'])
+			return
 
-		# plane
-		h2a = np.linspace(lens.right.inner_d/2, lens.right.outer_d/2)
-		z2a = np.zeros_like(h2a) + z2[-1]
-		self.sc.axes.plot(z2a, h2a, color)
-		self.sc.axes.plot(z2a, -h2a, color)
+		self.ui.lineEdit_Volume.setText('{:.4f}'.format(result['volume']))
 
-		# data
-		h2p = np.arange(0.0, lens.right.inner_d/2, step)
-		sag2 = lens.right.sag(h2p)
-		slope2 = lens.right.slope(h2p)
-		localR2 = lens.right.local_radius(h2p)
-		
-		table = self.ui.tableWidget_R2_Data
-		table.clear()
-		table.setColumnCount(len(header_labels))
-		table.setHorizontalHeaderLabels(header_labels)
-		table.setRowCount(len(h2p))
-		
-		for i in range(len(h2p)):
-			table.setItem(i,0, QtWidgets.QTableWidgetItem('{:.4f}'.format(h2p[i])))
-			table.setItem(i,1, QtWidgets.QTableWidgetItem('{:.4f}'.format(sag2[i])))
-			table.setItem(i,2, QtWidgets.QTableWidgetItem('{:.4f}'.format(slope2[i])))
-			table.setItem(i,3, QtWidgets.QTableWidgetItem('{:.4f}'.format(localR2[i])))
+		# the models format only the rows in view
+		for view, data in zip(views, result['tables']):
+			view.model().setColumns(data)
 
+		self.sc.setLimit(result['limit'])
+		self.sc.setLines(result['lines'])
 
-		# -----
-		# edge
-		# -----
-		z3 = np.array([z1[0], z2[0]],dtype=float)
-		h3 = np.array([lens.left.outer_d/2, lens.right.outer_d/2],dtype=float)
-		self.sc.axes.plot(z3, h3, color)
-		self.sc.axes.plot(z3, -h3, color)
 
+	def scheduleDrawing(self):
+		"""
+		Slot function connected to the edits, restarting the redraw timer
+		"""
+		self.pendingRow = self.ui.listWidget_Lens.currentRow()
+		self.redrawTimer.start()
 
-		# set axis scale
-		margin = 1.0
-		max_d = np.maximum(lens.left.outer_d/2,lens.right.outer_d/2)
-		axis_lim = np.maximum(max_d,lens.thickness) + margin
-		self.sc.axes.set_xlim([-axis_lim,axis_lim])
-		self.sc.axes.set_ylim([-axis_lim,axis_lim])
+	def commitPendingEdit(self):
+		"""
+		Stores a pending edit into its lens and drops its redraw
+		"""
+		if not self.redrawTimer.isActive():
+			return
+		self.redrawTimer.stop()
 
-		self.sc.draw()
+		if 0 <= self.pendingRow < len(self.lens_list):
+			self.lens_list[self.pendingRow] = self.getLensFromUI(self.pendingRow)
 
+	def flushDrawing(self):
+		"""
+		Redraws at once if an edit is pending
+		"""
+		if self.redrawTimer.isActive():
+			self.updateDrawing()
 
 	def updateDrawing(self):
 		""" 
 		Update the current lens data and drawing
 		"""
 		
+		self.redrawTimer.stop()
 		lens = self.getLensFromUI()
 		self.lens_list[self.ui.listWidget_Lens.currentRow()] = lens
 		self.drawLens(lens)
@@ -587,6 +755,8 @@ class Window(QtWidgets.QMainWindow):
 		msgBox.exec_()
 
 	def newFile(self):
+		self.redrawTimer.stop()
+		self.loading = None
 		self.currentFile = ""
 		self.disconnectAll()
 		self.lens_list.clear()
@@ -615,37 +785,54 @@ class Window(QtWidgets.QMainWindow):
 
 	def saveToJSON(self,filepath=""):
 
-		# dict of all lenses
-		dataset = {}
-		dataset['lens_count'] = len(self.lens_list)
-		for i,lens in enumerate(self.lens_list):
-			lens_dict = lens.to_dict()
-			dataset[str(i)] = lens_dict
+		self.flushDrawing()
+		if self.loading is not None:
+			self.loadLenses(self.loading, None)
 
-		# save as json
-		with open(filepath, 'w') as outfile:
-			json.dump(dataset,outfile, indent=4)
+		# lenses are written one by one
+		lensfile.write_lenses(filepath, self.lens_list)
 		
 		print("Saved to " + filepath)
 	
 	def loadFile(self,filepath=""):
+		self.redrawTimer.stop()
 		self.disconnectAll()
 		self.lens_list.clear()
 		self.ui.listWidget_Lens.clear()
-
-		with open(filepath) as f:
-			dataset = json.load(f)
-
-			lens_count = int(dataset['lens_count'])
-			for i in range(lens_count):
-				lens_dict = dataset[str(i)]
-				lens = Lens()
-				lens.from_dict(lens_dict)
-				self.addNewLens(lens)
 		self.connectAll()
 		self.currentFile = filepath
 
-		QtWidgets.QMessageBox.information(self, "Info", "JSON file has bben loaded")
+		# the first lens is shown at once, the rest follow in slices
+		self.loading = lensfile.read_lenses(filepath)
+		self.loadLenses(self.loading)
+
+	def loadLenses(self, lenses, time_slice=0.05):
+		"""
+		Adds lenses of a file being read for about time_slice seconds, or
+		all of them if None, then yields to the event loop
+		"""
+		if lenses is not self.loading:
+			# replaced by another file
+			return
+
+		deadline = None if time_slice is None else time.monotonic() + time_slice
+		for lens in lenses:
+			self.addNewLens(lens)
+			if self.ui.listWidget_Lens.currentRow() < 0:
+				self.ui.listWidget_Lens.setCurrentRow(0)
+				# let the first lens show up before reading on
+				break
+			if deadline is not None and time.monotonic() > deadline:
+				break
+		else:
+			self.loading = None
+			QtWidgets.QMessageBox.information(self, "Info", "JSON file has been loaded")
+			return
+
+		if time_slice is None:
+			self.loadLenses(lenses, None)
+		else:
+			QtCore.QTimer.singleShot(0, lambda: self.loadLenses(lenses, time_slice))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,235 @@
+""" Module for fitting surface profiles to measured sag
+"""
+
+"""
+    Copyright (C) 2020 Hiiragi <heterophyllus.work@gmail.com>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import warnings
+
+import numpy as np
+import surface as s
+
+
+def read_chunks(filepath, chunk_size=1000000, delimiter=None):
+    """
+    Reads (h, z) samples from a file in chunks
+
+    Args:
+        filepath(str): .npy file of shape (n, 2), or a text file with h and z columns
+        chunk_size(int): number of samples per chunk
+        delimiter(str): column delimiter of a text file, whitespace if None
+
+    Yields:
+        arrays of h and z
+    """
+    if filepath.endswith('.npy'):
+        data = np.load(filepath, mmap_mode='r')
+        for i in range(0, len(data), chunk_size):
+            chunk = np.array(data[i:i+chunk_size], dtype=float)
+            yield chunk[:, 0], chunk[:, 1]
+        return
+
+    with open(filepath) as f:
+        while True:
+            with warnings.catch_warnings():
+                # loadtxt warns on the empty read at the end of file
+                warnings.simplefilter('ignore', UserWarning)
+                chunk = np.loadtxt(f, delimiter=delimiter, max_rows=chunk_size, ndmin=2)
+            if len(chunk) == 0:
+                return
+            yield chunk[:, 0], chunk[:, 1]
+
+
+def fit_asphere(source, kind='ASP', n_coefs=8, r=None, k=0.0, refine=False, iterations=10):
+    """
+    Fits an EvenAsphere or OddAsphere to measured sag samples
+
+    The samples are read chunk by chunk and only the normal equations are
+    accumulated, so memory does not depend on the number of samples. The
+    source is read once per pass: for the initial radius, the polynomial
+    coefficients, each refinement step and the residual statistics.
+
+    Args:
+        source: file path for read_chunks(), a sequence of (h, z) array
+                pairs, or a callable returning a new iterator of them
+        kind(str): 'ASP' for EvenAsphere, 'ODD' for OddAsphere
+        n_coefs(int): number of polynomial coefficients
+        r(float): base radius, taken from the h^2 term of a polynomial fit if None
+        k(float): conic constant
+        refine(bool): refine r and k with the coefficients by Gauss-Newton steps
+        iterations(int): maximum number of refinement steps
+
+    Returns:
+        fitted surface, and dict of residual statistics 'rms', 'pv', 'max'
+        and the number of samples 'count'
+    """
+    if not isinstance(source, str) and not callable(source) and iter(source) is source:
+        raise TypeError("source is read several times, pass a sequence or a callable")
+
+    if kind == 'ASP':
+        cls = s.EvenAsphere
+        powers = 4 + 2*np.arange(n_coefs)
+    elif kind == 'ODD':
+        cls = s.OddAsphere
+        powers = 3 + np.arange(n_coefs)
+    else:
+        raise ValueError("unknown surface type: {}".format(kind))
+
+    if r is None:
+        # paraxial curvature from a pure polynomial fit
+        def design(h, z):
+            return np.power.outer(h, np.concatenate(([2], powers))), z
+        jtj, jty, _, _, _ = _normal_equations(source, design)
+        c = 2*_solve(jtj, jty)[0]
+    else:
+        c = s.Sphere(r).c
+
+    # one pass gives the normal equations of (c, k, coefs) around the
+    # current conic; the coefficients are always the linear optimum for it
+    jtj, jty, yty, count, h_max = _conic_equations(source, c, k, powers)
+    coefs = _solve(jtj[2:, 2:], jty[2:])
+    ssr = yty - jty[2:] @ coefs
+
+    if refine:
+        # Levenberg-Marquardt steps on (c, k), a rejected step is retried
+        # with more damping from the normal equations already at hand
+        lam = 1e-3
+        damping = np.zeros(len(jty))
+        for _ in range(iterations):
+            damping[:2] = lam
+            step = _solve(jtj, jty, damping)
+            trial = _conic_equations(source, c + step[0], k + step[1], powers)
+            trial_coefs = _solve(trial[0][2:, 2:], trial[1][2:])
+            trial_ssr = trial[2] - trial[1][2:] @ trial_coefs
+
+            if trial_ssr > ssr or trial[3] < count:
+                lam *= 10
+                continue
+
+            converged = ssr - trial_ssr <= 1e-12*ssr
+            c, k = c + step[0], k + step[1]
+            jtj, jty, yty, count, h_max = trial
+            coefs, ssr = trial_coefs, trial_ssr
+            lam = max(lam/10, 1e-12)
+            if converged:
+                break
+
+    surf = cls(_radius(c), k, coefs, 2*h_max, 2*h_max)
+
+    return surf, _residual_stats(source, surf)
+
+
+def _chunks(source):
+    if isinstance(source, str):
+        return read_chunks(source)
+    if callable(source):
+        return source()
+    return iter(source)
+
+
+def _normal_equations(source, design):
+    """ accumulates J^T J, J^T y and y^T y over all chunks
+    """
+    jtj = jty = None
+    yty = 0.0
+    count = 0
+    h_max = 0.0
+
+    for h, z in _chunks(source):
+        h = np.ravel(np.asarray(h, dtype=float))
+        z = np.ravel(np.asarray(z, dtype=float))
+        J, y = design(h, z)
+
+        # samples out of the valid aperture of the conic
+        ok = np.isfinite(y) & np.all(np.isfinite(J), axis=1)
+        J = J[ok]
+        y = y[ok]
+
+        if jtj is None:
+            jtj = np.zeros((J.shape[1], J.shape[1]))
+            jty = np.zeros(J.shape[1])
+        jtj += J.T @ J
+        jty += J.T @ y
+        yty += y @ y
+        count += len(y)
+        if len(y) > 0:
+            h_max = max(h_max, np.abs(h[ok]).max())
+
+    if count == 0:
+        raise ValueError("no valid samples")
+
+    return jtj, jty, yty, count, h_max
+
+
+def _conic_equations(source, c, k, powers):
+    conic = s.EvenAsphere(_radius(c), k, [])
+
+    def design(h, z):
+        dc, dk = _conic_partials(c, k, h)
+        J = np.column_stack((dc, dk, np.power.outer(h, powers)))
+        return J, z - conic.sag(h)
+
+    return _normal_equations(source, design)
+
+
+def _solve(jtj, jty, damping=0.0):
+    # scale the columns to unit norm before solving the normal equations
+    d = np.sqrt(np.diag(jtj))
+    d[d == 0] = 1.0
+    m = jtj/np.outer(d, d) + np.diag(np.broadcast_to(damping, d.shape))
+    x = np.linalg.lstsq(m, jty/d, rcond=None)[0]
+
+    return x/d
+
+
+def _conic_partials(c, k, h):
+    """ derivatives of the conic sag with respect to c and k
+    """
+    h2 = h*h
+    rt = np.sqrt(1.0 - (1.0+k) * c**2 * h2)
+    dc = h2/(rt*(1 + rt))
+    dk = c**3 * h2**2/(2*rt*(1 + rt)**2)
+
+    return dc, dk
+
+
+def _radius(c):
+    if c == 0.0:
+        return np.inf
+    return 1/c
+
+
+def _residual_stats(source, surf):
+    ssr = 0.0
+    count = 0
+    res_min = np.inf
+    res_max = -np.inf
+
+    for h, z in _chunks(source):
+        res = np.ravel(np.asarray(z, dtype=float)) - surf.sag(np.ravel(np.asarray(h, dtype=float)))
+        res = res[np.isfinite(res)]
+        if len(res) == 0:
+            continue
+        ssr += res @ res
+        count += len(res)
+        res_min = min(res_min, res.min())
+        res_max = max(res_max, res.max())
+
+    return {'rms': np.sqrt(ssr/count),
+            'pv': res_max - res_min,
+            'max': max(abs(res_min), abs(res_max)),
+            'count': count}
@@ -295,21 +295,17 @@ class Ui_MainWindow(object):
         self.tab_R1_Data.setObjectName("tab_R1_Data")
         self.horizontalLayout = QtWidgets.QHBoxLayout(self.tab_R1_Data)
         self.horizontalLayout.setObjectName("horizontalLayout")
-        self.tableWidget_R1_Data = QtWidgets.QTableWidget(self.tab_R1_Data)
-        self.tableWidget_R1_Data.setObjectName("tableWidget_R1_Data")
-        self.tableWidget_R1_Data.setColumnCount(0)
-        self.tableWidget_R1_Data.setRowCount(0)
-        self.horizontalLayout.addWidget(self.tableWidget_R1_Data)
+        self.tableView_R1_Data = QtWidgets.QTableView(self.tab_R1_Data)
+        self.tableView_R1_Data.setObjectName("tableView_R1_Data")
+        self.horizontalLayout.addWidget(self.tableView_R1_Data)
         self.tabWidget.addTab(self.tab_R1_Data, "")
         self.tab_R2_Data = QtWidgets.QWidget()
         self.tab_R2_Data.setObjectName("tab_R2_Data")
         self.horizontalLayout_2 = QtWidgets.QHBoxLayout(self.tab_R2_Data)
         self.horizontalLayout_2.setObjectName("horizontalLayout_2")
-        self.tableWidget_R2_Data = QtWidgets.QTableWidget(self.tab_R2_Data)
-        self.tableWidget_R2_Data.setObjectName("tableWidget_R2_Data")
-        self.tableWidget_R2_Data.setColumnCount(0)
-        self.tableWidget_R2_Data.setRowCount(0)
-        self.horizontalLayout_2.addWidget(self.tableWidget_R2_Data)
+        self.tableView_R2_Data = QtWidgets.QTableView(self.tab_R2_Data)
+        self.tableView_R2_Data.setObjectName("tableView_R2_Data")
+        self.horizontalLayout_2.addWidget(self.tableView_R2_Data)
         self.tabWidget.addTab(self.tab_R2_Data, "")
         self.gridLayout_2.addWidget(self.tabWidget, 0, 1, 1, 3)
         MainWindow.setCentralWidget(self.centralwidget)
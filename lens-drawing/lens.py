@@ -18,8 +18,23 @@
     along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import hashlib
+
 import numpy as np
 import surface as s
+from material import catalog
+
+
+def density(material):
+    """ density of the material in g/cm^3 from the material catalog, nan if unknown
+    """
+    return catalog.density(material)
+
+
+# Gauss-Legendre nodes and weights mapped to [0, 1]
+_gl_x, _gl_w = np.polynomial.legendre.leggauss(16)
+_gl_x = (_gl_x + 1)/2
+_gl_w = _gl_w/2
 
 class Lens:
     def __init__(self, left_surf=None, right_surf=None, name= "", thickness=0.0, material=""):
@@ -43,14 +58,39 @@ class Lens:
 
     @property
     def volume(self):
-        pass
+        """ volume in mm^3
+        """
+        return volumes([self])[0]
 
     @property
     def weight(self):
-        pass
+        """ weight in g
+        """
+        return weights([self])[0]
 
     def edge_thickness(self, h):
-        pass
+        """
+        Axial thickness at height h, scalar or array
+
+        Outside of the clear apertures the flat annuli are used, and nan is
+        returned beyond the outer diameter.
+        """
+        t = edge_thicknesses([self], np.ravel(h))[0]
+        if np.ndim(h) == 0:
+            return float(t[0])
+        return t.reshape(np.shape(h))
+
+    def geometry_hash(self, digits=None):
+        """ content hash of the geometry, see geometry_hashes()
+        """
+        return str(geometry_hashes([self], digits)[0])
+
+    def min_thickness(self, n=256):
+        """
+        Minimum thickness within the outer diameter and the height where it occurs
+        """
+        t, h = min_thicknesses([self], n)
+        return t[0], h[0]
 
     def to_dict(self):
         dct = {}
@@ -58,30 +98,8 @@ class Lens:
         dct['material'] = self.material
         dct['thickness'] = self.thickness
         dct['description'] = self.description
-
-        dct['left'] = {}
-        dct['left']['type'] = self.left.type
-        dct['left']['inner_d'] = self.left.inner_d
-        dct['left']['outer_d'] = self.left.outer_d
-        dct['left']['radius'] = self.left.r
-        if self.left.type != 'SPH':
-            dct['left']['k'] = self.left.k
-            if isinstance(self.left.coefs, np.ndarray):
-                dct['left']['coefs'] = self.left.coefs.tolist()
-            else:
-                dct['left']['coefs'] = self.left.coefs
-        
-        dct['right'] = {}
-        dct['right']['type'] = self.right.type
-        dct['right']['inner_d'] = self.right.inner_d
-        dct['right']['outer_d'] = self.right.outer_d
-        dct['right']['radius'] = self.right.r
-        if self.right.type != 'SPH':
-            dct['right']['k'] = self.right.k
-            if isinstance(self.right.coefs, np.ndarray):
-                dct['right']['coefs'] = self.right.coefs.tolist()
-            else:
-                dct['right']['coefs'] = self.right.coefs
+        dct['left'] = _surface_to_dict(self.left)
+        dct['right'] = _surface_to_dict(self.right)
 
         return dct
 
@@ -93,44 +111,487 @@ class Lens:
         self.material = dct['material']
         self.thickness = float(dct['thickness'])
         self.description = dct['description']
-        
-        # left
-        if dct['left']['type'] == 'SPH':
-            self.left = s.Sphere()
-            try:
-                self.left.r = float(dct['left']['radius'])
-            except ValueError:
-                self.left.r = np.inf
-        else:
-            self.left = s.EvenAsphere()
-            try:
-                self.left.r = float(dct['left']['radius'])
-            except ValueError:
-                self.left.r = np.inf
-            self.left.k = float(dct['left']['k'])
-            self.left.coefs = np.array(dct['left']['coefs'], dtype=float)
-
-        self.left.inner_d = float(dct['left']['inner_d'])
-        self.left.outer_d = float(dct['left']['outer_d'])
-
-        # right
-        if dct['right']['type'] == 'SPH':
-            self.right = s.Sphere()
-            try:
-                self.right.r = float(dct['right']['radius'])
-            except ValueError:
-                self.right.r = np.inf
-        else:
-            self.right = s.EvenAsphere()
-            try:
-                self.right.r = dct['right']['radius']
-            except ValueError:
-                self.right.r = np.inf
-            self.right.k = float(dct['right']['k'])
-            self.right.coefs = np.array(dct['right']['coefs'], dtype=float)
+        self.left = _surface_from_dict(dct['left'])
+        self.right = _surface_from_dict(dct['right'])
+
+
+def _surface_to_dict(surf):
+    dct = {}
+    dct['type'] = surf.type
+    dct['inner_d'] = surf.inner_d
+    dct['outer_d'] = surf.outer_d
+    dct['radius'] = surf.r
+    if surf.type != 'SPH':
+        dct['k'] = surf.k
+        dct['coefs'] = surf.coefs.tolist()
+
+    return dct
+
+
+def _surface_from_dict(dct):
+    try:
+        r = float(dct['radius'])
+    except ValueError:
+        r = np.inf
+
+    inner_d = float(dct['inner_d'])
+    outer_d = float(dct['outer_d'])
+
+    if dct['type'] == 'SPH':
+        return s.Sphere(r, inner_d, outer_d)
+    elif dct['type'] == 'ODD':
+        return s.OddAsphere(r, float(dct['k']), dct['coefs'], inner_d, outer_d)
+    else:
+        return s.EvenAsphere(r, float(dct['k']), dct['coefs'], inner_d, outer_d)
+
+
+def _text(values, n):
+    # object arrays hold references to the strings, a fixed width column
+    # would pad every row to the longest text
+    if values is None:
+        return np.full(n, '', dtype=object)
+    return np.array(np.broadcast_to(np.asarray(values, dtype=object), (n,)))
+
+
+class LensTable:
+    """
+    Columnar container for many lenses
+
+    The surfaces are kept in one SurfaceBatch per side, thickness in a
+    NumPy column and name, material and description in object columns of
+    str, so a large catalog costs a few hundred bytes per lens instead of a
+    graph of Python objects. Indexing with an int gives a LensRow that
+    reads and writes the columns in place; slices, masks and index arrays
+    give a new table holding a copy of the selected rows.
+
+    The module level functions (volumes, weights, edge_thicknesses, ...)
+    accept a table in place of a list of lenses.
+    """
+
+    def __init__(self, left, right, thickness=None, name=None, material=None, description=None):
+        n = len(left)
+        if len(right) != n:
+            raise ValueError("left and right surfaces differ in length")
+
+        self.left = left
+        self.right = right
+        if thickness is None:
+            thickness = np.zeros(n)
+        self.thickness = np.ascontiguousarray(thickness, dtype=float)
+        self.name = _text(name, n)
+        self.material = _text(material, n)
+        self.description = _text(description, n)
+
+    @classmethod
+    def from_lenses(cls, lenses):
+        left, right, thickness = _batches(lenses)
+        return cls(left, right, thickness,
+                   name=[lens.name for lens in lenses],
+                   material=[lens.material for lens in lenses],
+                   description=[lens.description for lens in lenses])
+
+    @classmethod
+    def concatenate(cls, tables):
+        tables = list(tables)
+
+        def join(name):
+            return np.concatenate([getattr(table, name) for table in tables])
+
+        if len(tables) == 0:
+            return cls.from_lenses([])
+        return cls(s.SurfaceBatch.concatenate([table.left for table in tables]),
+                   s.SurfaceBatch.concatenate([table.right for table in tables]),
+                   join('thickness'), join('name'), join('material'), join('description'))
+
+    def to_lenses(self):
+        """ independent Lens objects of all rows
+        """
+        lenses = []
+        for i in range(len(self)):
+            lens = Lens(self.left[i], self.right[i], str(self.name[i]),
+                        float(self.thickness[i]), str(self.material[i]))
+            lens.description = str(self.description[i])
+            lenses.append(lens)
+
+        return lenses
+
+    def column(self, name):
+        """
+        Column by name: 'thickness', 'name', 'material', 'description' or a
+        surface column of a side such as 'left.r' or 'right.outer_d'
+        """
+        side, _, field = name.rpartition('.')
+        if side in ('left', 'right'):
+            return getattr(getattr(self, side), field)
+        return getattr(self, name)
+
+    def __len__(self):
+        return len(self.thickness)
+
+    def __getitem__(self, index):
+        if np.ndim(index) == 0 and not isinstance(index, slice):
+            i = int(index)
+            if not -len(self) <= i < len(self):
+                raise IndexError("lens index out of range")
+            return LensRow(self, i % len(self))
+
+        if isinstance(index, slice):
+            # basic slicing would give views into this table
+            index = np.arange(len(self))[index]
+        return LensTable(self.left[index], self.right[index],
+                         self.thickness[index], self.name[index],
+                         self.material[index], self.description[index])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield LensRow(self, i)
+
+    def volumes(self):
+        return volumes(self)
+
+    def weights(self):
+        return weights(self)
+
+    def edge_thicknesses(self, h):
+        return edge_thicknesses(self, h)
+
+    def min_thicknesses(self, n=256):
+        return min_thicknesses(self, n)
+
+    def validate_apertures(self, max_slope=None):
+        return validate_apertures(self, max_slope)
+
+
+def _row_property(column):
+    def fget(self):
+        return getattr(self._table, column)[self._i]
+
+    def fset(self, value):
+        getattr(self._table, column)[self._i] = value
+
+    return property(fget, fset)
+
+
+def _text_property(column):
+    def fget(self):
+        return str(getattr(self._table, column)[self._i])
+
+    def fset(self, value):
+        getattr(self._table, column)[self._i] = str(value)
+
+    return property(fget, fset)
+
+
+class LensRow(Lens):
+    """
+    Lens backed by a row of a LensTable
+
+    Reading an attribute reads the column and assigning writes it back, so
+    the row behaves like a Lens without copying it out of the table.
+    """
+
+    def __init__(self, table, i):
+        self._table = table
+        self._i = i
+
+    left = _row_property('left')
+    right = _row_property('right')
+    name = _text_property('name')
+    material = _text_property('material')
+    description = _text_property('description')
+
+    @property
+    def thickness(self):
+        return float(self._table.thickness[self._i])
+
+    @thickness.setter
+    def thickness(self, value):
+        self._table.thickness[self._i] = value
+
+
+def volumes(lenses):
+    """
+    Volumes of many lenses in mm^3
+
+    Each lens is a solid of revolution bounded by the two profiles within
+    the clear aperture, the flat annuli out to the outer diameters and the
+    edge joining them.
+    """
+    left, right, thickness = _batches(lenses)
+    return _volumes(left, right, thickness)
+
+
+def weights(lenses):
+    """
+    Weights of many lenses in g, nan for unknown materials
+    """
+    table = _table(lenses)
+
+    # look up each distinct material once
+    materials, inverse = np.unique(table.material, return_inverse=True)
+    rho = np.array([density(m) for m in materials], dtype=float)[inverse.reshape(-1)]
+
+    return volumes(table) * rho * 1e-3
+
+
+def validate_apertures(lenses, max_slope=None):
+    """
+    Flags lenses whose diameters exceed the valid semi-aperture of a surface
+
+    Only the closed form limits (and max_slope, if given) are evaluated, so
+    this is cheap enough to run over a whole library before anything else.
+
+    Returns:
+        boolean arrays, True where inner_d and where outer_d of either
+        surface is larger than twice its maximum semi-aperture
+    """
+    left, right, _ = _batches(lenses)
+    inner = np.zeros(len(lenses), dtype=bool)
+    outer = np.zeros(len(lenses), dtype=bool)
+    for surfaces in (left, right):
+        h_max = surfaces.max_semi_aperture(max_slope)
+        inner |= surfaces.inner_d/2 > h_max
+        outer |= surfaces.outer_d/2 > h_max
+
+    return inner, outer
+
+
+def edge_thicknesses(lenses, h):
+    """
+    Axial thickness of many lenses
+
+    Args:
+        lenses: list of Lens or LensTable
+        h: heights, 1-D array shared by all lenses or (N, M) array
+
+    Returns:
+        (N, M) array of thickness
+    """
+    left, right, thickness = _batches(lenses)
+    return _edge_thickness(left, right, thickness, h)
+
+
+def min_thicknesses(lenses, n=256):
+    """
+    Minimum thickness of many lenses and the heights where it occurs
+
+    The thickness is probed on n heights up to the smaller outer radius,
+    including the ends of both clear apertures, and the minimum is refined
+    by a parabola through its neighbours.
+
+    Returns:
+        arrays of minimum thickness and its height
+    """
+    left, right, thickness = _batches(lenses)
+    return _min_thickness(left, right, thickness, n)
+
+
+def geometry_hashes(lenses, digits=None):
+    """
+    Content hashes of the lens geometry
+
+    The hash covers thickness and both surfaces, but not name, material or
+    description. Floats are normalized first (-0.0, nan, trailing zero
+    coefficients, k of flat surfaces), and a polynomial surface without
+    coefficients hashes like the conic it is. With digits, every value is
+    rounded to that many significant digits so near-identical lenses
+    collide; values close to a rounding boundary may still differ.
+
+    Args:
+        lenses: LensTable, LensLibrary or list of Lens
+        digits(int): significant digits, exact comparison if None
+
+    Returns:
+        array of hex digests
+    """
+    left, right, thickness = _batches(lenses)
+    thickness = _quantize(thickness, digits)
+    sides = [_canonical_surfaces(batch, digits) for batch in (left, right)]
+
+    hashes = []
+    for i in range(len(thickness)):
+        h = hashlib.blake2b(thickness[i].tobytes(), digest_size=16)
+        for scalars, coefs, n in sides:
+            h.update(scalars[i].tobytes())
+            h.update(coefs[i, :n[i]].tobytes())
+        hashes.append(h.hexdigest())
+
+    return np.array(hashes, dtype=str)
+
+
+def deduplicate(lenses, digits=None):
+    """
+    Collapses lenses of the same geometry
+
+    Args:
+        lenses: LensTable, LensLibrary or list of Lens
+        digits(int): significant digits as in geometry_hashes()
+
+    Returns:
+        the unique lenses in order of first occurrence, as the same kind of
+        collection (a LensTable for a library), and for every input lens
+        the index of its unique lens
+    """
+    _, first, inverse = np.unique(geometry_hashes(lenses, digits),
+                                  return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    # renumber the groups by first occurrence
+    order = np.argsort(first, kind='stable')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    first = first[order]
+
+    if isinstance(lenses, (list, tuple)):
+        unique = [lenses[i] for i in first]
+    else:
+        unique = lenses[first]
+
+    return unique, rank[inverse]
+
+
+def merge(collections, digits=None):
+    """
+    Merges several lens collections keeping each geometry once
+
+    Returns:
+        LensTable of unique lenses, and one array of references into it
+        per collection
+    """
+    tables = [_table(lenses) for lenses in collections]
+    unique, refs = deduplicate(LensTable.concatenate(tables), digits)
+    bounds = np.cumsum([0] + [len(table) for table in tables])
+
+    return unique, [refs[bounds[j]:bounds[j+1]] for j in range(len(tables))]
+
+
+def _table(lenses):
+    if isinstance(lenses, LensTable):
+        return lenses
+    if hasattr(lenses, 'to_table'):
+        return lenses.to_table()
+    return LensTable.from_lenses(lenses)
+
+
+def _quantize(x, digits):
+    x = np.where(np.isnan(x), np.nan, x) + 0.0
+    if digits is None:
+        return x
+
+    finite = np.isfinite(x) & (x != 0)
+    with np.errstate(divide='ignore'):
+        e = np.floor(np.log10(np.abs(np.where(finite, x, 1.0))))
+    scale = 10.0**(digits - 1 - e)
+    return np.where(finite, np.round(x*scale)/scale, x) + 0.0
+
+
+def _canonical_surfaces(batch, digits):
+    """ per row scalars, coefficients and number of coefficients to hash
+    """
+    coefs = _quantize(batch.coefs, digits)
+    nonzero = coefs != 0
+    n = np.max(nonzero * np.arange(1, coefs.shape[1]+1), axis=1, initial=0)
+
+    kind = np.where(n > 0, batch.kind, 0)
+    k = np.where(np.isinf(batch.r), 0.0, batch.k)
+    scalars = np.column_stack((kind, _quantize(batch.r, digits), _quantize(k, digits),
+                               _quantize(batch.inner_d, digits), _quantize(batch.outer_d, digits), n))
+
+    return np.ascontiguousarray(scalars), coefs, n
+
+
+def _batches(lenses):
+    if hasattr(lenses, 'to_table'):
+        lenses = lenses.to_table()
+    if isinstance(lenses, LensTable):
+        return lenses.left, lenses.right, lenses.thickness
+
+    left = s.SurfaceBatch.from_surfaces([lens.left for lens in lenses])
+    right = s.SurfaceBatch.from_surfaces([lens.right for lens in lenses])
+    thickness = np.array([lens.thickness for lens in lenses], dtype=float)
+
+    return left, right, thickness
+
+
+def _edge_sag(surfaces, a):
+    # integral of 2*pi*h*z(h) over [0, a] by Gauss-Legendre quadrature,
+    # and the sag at a where the flat annulus starts
+    h = np.concatenate((a[:, np.newaxis]*_gl_x, a[:, np.newaxis]), axis=1)
+    z = surfaces.sag(h)
+    integral = 2*np.pi * a**2 * np.dot(z[:, :-1]*_gl_x, _gl_w)
+
+    return integral, z[:, -1]
+
+
+def _volumes(left, right, thickness):
+    r_left = left.outer_d/2
+    r_right = right.outer_d/2
+    r_min = np.minimum(r_left, r_right)
+    r_max = np.maximum(r_left, r_right)
+
+    a_left = np.minimum(left.inner_d/2, r_min)
+    a_right = np.minimum(right.inner_d/2, r_min)
+    int_left, z_left = _edge_sag(left, a_left)
+    int_right, z_right = _edge_sag(right, a_right)
+
+    # thickness profile t + z_right(h) - z_left(h) integrated up to r_min
+    v = (np.pi * r_min**2 * thickness
+         + int_right + z_right * np.pi * (r_min**2 - a_right**2)
+         - int_left - z_left * np.pi * (r_min**2 - a_left**2))
+
+    # triangle between the slanted edge and the larger flat, by Pappus
+    area = 0.5 * np.abs(thickness + z_right - z_left) * (r_max - r_min)
+    v += 2*np.pi * (2*r_min + r_max)/3 * area
+
+    return v
+
+
+def _edge_thickness(left, right, thickness, h):
+    h = np.abs(np.asarray(h, dtype=float))
+    r_min = np.minimum(left.outer_d, right.outer_d)[:, np.newaxis]/2
+    r_max = np.maximum(left.outer_d, right.outer_d)[:, np.newaxis]/2
+    a_left = np.minimum(left.inner_d[:, np.newaxis]/2, r_min)
+    a_right = np.minimum(right.inner_d[:, np.newaxis]/2, r_min)
+
+    hh = np.minimum(h, r_min)
+    z_left = left.sag(np.minimum(hh, a_left))
+    z_right = right.sag(np.minimum(hh, a_right))
+    t = thickness[:, np.newaxis] + z_right - z_left
+
+    # along the slanted edge between the two outer diameters the
+    # thickness falls linearly to zero
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.where(h > r_min, t*(r_max - h)/(r_max - r_min), t)
+
+    return np.where(h > r_max, np.nan, t)
+
+
+def _min_thickness(left, right, thickness, n):
+    r_min = np.minimum(left.outer_d, right.outer_d)/2
+    a_left = np.minimum(left.inner_d/2, r_min)
+    a_right = np.minimum(right.inner_d/2, r_min)
 
-        self.right.inner_d = float(dct['right']['inner_d'])
-        self.right.outer_d = float(dct['right']['outer_d'])
+    h = np.concatenate((r_min[:, np.newaxis]*np.linspace(0.0, 1.0, n),
+                        a_left[:, np.newaxis], a_right[:, np.newaxis]), axis=1)
+    h.sort(axis=1)
+    t = _edge_thickness(left, right, thickness, h)
 
+    rows = np.arange(len(thickness))
+    i = np.nanargmin(t, axis=1)
+    t_min = t[rows, i]
+    h_min = h[rows, i]
 
+    # parabola through the neighbours of interior minima
+    j = np.clip(i, 1, h.shape[1]-2)
+    h0, h1, h2 = h[rows, j-1], h[rows, j], h[rows, j+1]
+    t0, t1, t2 = t[rows, j-1], t[rows, j], t[rows, j+1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        num = (h1-h0)**2*(t1-t2) - (h1-h2)**2*(t1-t0)
+        den = (h1-h0)*(t1-t2) - (h1-h2)*(t1-t0)
+        hv = h1 - 0.5*num/den
+    inside = np.isfinite(hv) & (hv > h0) & (hv < h2)
+    hv = np.where(inside, hv, h_min)
+    tv = _edge_thickness(left, right, thickness, hv[:, np.newaxis])[:, 0]
 
+    better = tv < t_min
+    return np.where(better, tv, t_min), np.where(better, hv, h_min)
@@ -0,0 +1,164 @@
+""" Module for importing lens lists from CSV files
+"""
+
+"""
+    Copyright (C) 2020 Hiiragi <heterophyllus.work@gmail.com>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import csv
+import itertools
+
+import numpy as np
+import surface as s
+from lens import LensTable
+
+
+# normalized header -> column of the table
+_columns = {
+    'name': 'name',
+    'material': 'material',
+    'thickness': 'thickness',
+    'radius1': 'left.r',
+    'cleardiameter1': 'left.inner_d',
+    'edgediameter1': 'left.outer_d',
+    'radius2': 'right.r',
+    'cleardiameter2': 'right.inner_d',
+    'edgediameter2': 'right.outer_d',
+}
+
+# misspellings found in vendor files
+_aliases = {
+    'cleardiamter1': 'cleardiameter1',
+    'cleardiamter2': 'cleardiameter2',
+    'edgediamter1': 'edgediameter1',
+    'edgediamter2': 'edgediameter2',
+}
+
+_numeric = ('thickness', 'left.r', 'left.inner_d', 'left.outer_d',
+            'right.r', 'right.inner_d', 'right.outer_d')
+
+
+def read_csv(filepath, chunk_size=50000, delimiter=','):
+    """
+    Reads a lens list in the lens.csv schema into a LensTable
+
+    Returns:
+        LensTable, and list of (line number, reason) of the skipped rows
+    """
+    tables = []
+    bad_rows = []
+    for table, bad in read_csv_chunks(filepath, chunk_size, delimiter):
+        tables.append(table)
+        bad_rows.extend(bad)
+
+    return LensTable.concatenate(tables), bad_rows
+
+
+def read_csv_chunks(filepath, chunk_size=50000, delimiter=','):
+    """
+    Reads a lens list in the lens.csv schema chunk by chunk
+
+    Headers are matched case-insensitively, ignoring spaces and
+    underscores, and known misspellings such as ClearDiamter2 are
+    accepted. Other columns (PosX, PosY, ...) are ignored. Both surfaces
+    are spheres with Radius as radius, ClearDiameter as inner_d and
+    EdgeDiameter as outer_d. Rows with a wrong number of fields or values
+    that are not numbers are skipped and reported.
+
+    Args:
+        filepath(str): path of the CSV file
+        chunk_size(int): number of rows per chunk
+        delimiter(str): field delimiter
+
+    Yields:
+        LensTable of the valid rows of a chunk, and list of
+        (line number, reason) of its skipped rows
+    """
+    with open(filepath, newline='') as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        header = next(reader, None)
+        if header is None:
+            return
+        fields = _fields(header)
+        line = 2
+
+        while True:
+            rows = list(itertools.islice(reader, chunk_size))
+            if len(rows) == 0:
+                return
+            yield _convert(rows, fields, len(header), line)
+            line += len(rows)
+
+
+def _fields(header):
+    """ column of the table for each field of the header, None if unused
+    """
+    fields = []
+    for name in header:
+        key = name.strip().lower().replace(' ', '').replace('_', '')
+        fields.append(_columns.get(_aliases.get(key, key)))
+
+    missing = [c for c in _numeric if c not in fields]
+    if missing:
+        raise ValueError("missing columns: {}".format(', '.join(missing)))
+
+    return fields
+
+
+def _convert(rows, fields, width, line):
+    bad = np.array([len(row) != width for row in rows], dtype=bool)
+    # blank lines are skipped silently
+    reasons = {i: "expected {} fields, found {}".format(width, len(rows[i]))
+               for i in np.flatnonzero(bad) if len(rows[i]) > 0}
+    rows = [row if len(row) == width else [''] * width for row in rows]
+    texts = dict(zip(fields, zip(*rows)))
+
+    values = {}
+    for column in _numeric:
+        text = texts[column]
+        try:
+            values[column] = np.fromiter(map(float, text), dtype=float, count=len(text))
+        except ValueError:
+            # parse one by one to find the offending rows
+            values[column] = np.array([_number(x) for x in text], dtype=float)
+        invalid = np.isnan(values[column]) & ~bad
+        for i in np.flatnonzero(invalid):
+            reasons[i] = "{}: invalid number {!r}".format(column, text[i])
+        bad |= invalid
+
+    ok = ~bad
+    sides = {}
+    for side in ('left', 'right'):
+        sides[side] = s.SurfaceBatch(kind=np.zeros(ok.sum()),
+                                     r=values[side + '.r'][ok],
+                                     inner_d=values[side + '.inner_d'][ok],
+                                     outer_d=values[side + '.outer_d'][ok])
+
+    strings = {}
+    for column in ('name', 'material'):
+        if column in texts:
+            strings[column] = np.char.strip(np.array(texts[column], dtype=str)[ok])
+
+    table = LensTable(sides['left'], sides['right'], values['thickness'][ok], **strings)
+
+    return table, [(line + int(i), reasons[i]) for i in sorted(reasons)]
+
+
+def _number(text):
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
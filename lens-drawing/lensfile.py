@@ -0,0 +1,182 @@
+""" Module for reading and writing lens files
+"""
+
+"""
+    Copyright (C) 2020 Hiiragi <heterophyllus.work@gmail.com>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+
+from lens import Lens
+
+
+_decoder = json.JSONDecoder()
+_whitespace = ' \t\n\r'
+
+
+def read_lenses(filepath, chunk_size=65536):
+    """
+    Reads the lenses of a lens file one at a time
+
+    A lens file is a JSON object with 'lens_count' and one entry per lens
+    keyed "0", "1", ... The members are parsed as the file is read, so the
+    first lens is available at once and memory does not grow with the
+    file. Entries stored out of order are held back until their turn.
+
+    Args:
+        filepath(str): path of the lens file
+        chunk_size(int): number of characters read at a time
+
+    Yields:
+        Lens
+    """
+    count = None
+    pending = {}
+    i = 0
+
+    with open(filepath) as f:
+        for key, value in _members(f, chunk_size):
+            if key == 'lens_count':
+                count = int(value)
+            elif key.isdigit():
+                pending[key] = value
+
+            while (count is None or i < count) and str(i) in pending:
+                lens = Lens()
+                lens.from_dict(pending.pop(str(i)))
+                yield lens
+                i += 1
+
+    if count is None:
+        raise ValueError("lens_count is missing in {}".format(filepath))
+    if i < count:
+        raise ValueError("lens {} is missing in {}".format(i, filepath))
+
+
+def write_lenses(filepath, lenses):
+    """
+    Writes lenses to a lens file one at a time
+
+    The output is the same as json.dump() of the whole dataset with
+    indent=4, but only one lens is held as a dict at a time. If lenses has
+    no len(), e.g. a generator, lens_count is written after the lenses.
+
+    Args:
+        filepath(str): path of the lens file
+        lenses: iterable of Lens
+
+    Returns:
+        number of lenses written
+    """
+    try:
+        count = len(lenses)
+    except TypeError:
+        count = None
+
+    n = 0
+    with open(filepath, 'w') as f:
+        f.write('{')
+        sep = '\n    '
+        if count is not None:
+            f.write('{}"lens_count": {}'.format(sep, count))
+            sep = ',\n    '
+
+        for lens in lenses:
+            entry = json.dumps(lens.to_dict(), indent=4).replace('\n', '\n    ')
+            f.write('{}"{}": {}'.format(sep, n, entry))
+            sep = ',\n    '
+            n += 1
+
+        if count is None:
+            f.write('{}"lens_count": {}'.format(sep, n))
+        f.write('\n}')
+
+    return n
+
+
+def _members(f, chunk_size):
+    """ (key, value) pairs of the top level object of a JSON file
+    """
+    scan = _Scanner(f, chunk_size)
+    scan.expect('{')
+    if scan.peek() == '}':
+        return
+
+    while True:
+        key = scan.value()
+        scan.expect(':')
+        yield key, scan.value()
+        if scan.expect(',}') == '}':
+            return
+
+
+class _Scanner:
+    """ buffer over a text file, holding at most one member beyond a chunk
+    """
+
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _read(self):
+        chunk = self.f.read(self.chunk_size)
+        if chunk == '':
+            self.eof = True
+            return False
+
+        # the parsed part of the buffer is dropped
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """ next non-whitespace character, '' at the end of the file
+        """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _whitespace:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._read():
+                return ''
+
+    def expect(self, chars):
+        c = self.peek()
+        if c == '' or c not in chars:
+            raise ValueError("malformed lens file: expected {!r}, found {!r}".format(chars, c))
+        self.pos += 1
+        return c
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # the value continues in the next chunk
+                if not self._read():
+                    raise
+                continue
+
+            # so might a number ending with the buffer
+            if end == len(self.buf) and self._read():
+                continue
+
+            self.pos = end
+            return value
@@ -0,0 +1,202 @@
+""" Module for binary lens libraries
+"""
+
+"""
+    Copyright (C) 2020 Hiiragi <heterophyllus.work@gmail.com>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+File layout, all numbers little-endian:
+
+    magic       8 bytes b'LENSLIB\\0'
+    version     uint32
+    header      uint32 length, then a UTF-8 JSON object
+    columns     raw arrays, each starting on a 64 byte boundary
+
+The header holds the lens count and, for every column, its dtype, shape
+and offset from the end of the header. Numeric columns are thickness and,
+for each side, kind, r, k, n_coefs, inner_d, outer_d and the zero padded
+(N, M) coefs. Texts are int32 indices into a table of distinct strings,
+stored as UTF-8 bytes with their start offsets.
+"""
+
+import json
+
+import numpy as np
+import surface as s
+from lens import Lens, LensTable
+
+
+_magic = b'LENSLIB\0'
+_version = 1
+_align = 64
+
+_surface_columns = (('kind', '<i1'), ('r', '<f8'), ('k', '<f8'), ('n_coefs', '<i4'),
+                    ('inner_d', '<f8'), ('outer_d', '<f8'), ('coefs', '<f8'))
+_texts = ('name', 'material', 'description')
+
+
+def write_library(filepath, lenses):
+    """
+    Writes lenses to a binary lens library
+
+    Args:
+        filepath(str): path of the library file
+        lenses: LensTable or list of Lens
+
+    Returns:
+        number of lenses written
+    """
+    if not isinstance(lenses, LensTable):
+        lenses = LensTable.from_lenses(lenses)
+    n = len(lenses)
+
+    columns = {'thickness': lenses.thickness.astype('<f8')}
+    for side in ('left', 'right'):
+        batch = getattr(lenses, side)
+        for name, dtype in _surface_columns:
+            columns[side + '.' + name] = getattr(batch, name).astype(dtype)
+
+    # one table of distinct strings shared by the text columns
+    strings, ids = np.unique(np.concatenate([getattr(lenses, t) for t in _texts]),
+                             return_inverse=True)
+    for j, t in enumerate(_texts):
+        columns[t] = ids.reshape(-1)[j*n:(j+1)*n].astype('<i4')
+    encoded = [str(x).encode('utf-8') for x in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype='<i8')
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    columns['string_offsets'] = offsets
+    columns['string_data'] = np.frombuffer(b''.join(encoded), dtype='u1')
+
+    index = {}
+    offset = 0
+    for name, values in columns.items():
+        index[name] = {'dtype': values.dtype.str, 'shape': list(values.shape), 'offset': offset}
+        offset = _aligned(offset + values.nbytes)
+
+    header = json.dumps({'count': n, 'columns': index}).encode('utf-8')
+    start = _aligned(len(_magic) + 8 + len(header))
+
+    with open(filepath, 'wb') as f:
+        f.write(_magic)
+        f.write(np.array([_version, len(header)], dtype='<u4').tobytes())
+        f.write(header)
+        for name, values in columns.items():
+            f.write(b'\0' * (start + index[name]['offset'] - f.tell()))
+            f.write(values.tobytes())
+
+    return n
+
+
+class LensLibrary:
+    """
+    Lens library opened by memory mapping
+
+    Opening only parses the header; the columns are views of the mapped
+    file, so the pages of a lens are read when it is accessed. Indexing
+    with an int gives a Lens, and slices, masks and index arrays a
+    LensTable holding a copy of the selected rows.
+
+    The numeric columns are available as attributes, e.g. thickness or
+    left_r, for selecting rows without loading the lenses.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._map = np.memmap(filepath, dtype='u1', mode='r')
+
+        if bytes(self._map[:len(_magic)]) != _magic:
+            raise ValueError("{} is not a lens library".format(filepath))
+        version, length = np.frombuffer(self._map[8:16], dtype='<u4')
+        if version > _version:
+            raise ValueError("unsupported lens library version: {}".format(version))
+
+        header = json.loads(bytes(self._map[16:16+length]).decode('utf-8'))
+        start = _aligned(16 + int(length))
+        self._count = header['count']
+        self._columns = {}
+        for name, info in header['columns'].items():
+            dtype = np.dtype(info['dtype'])
+            shape = tuple(info['shape'])
+            begin = start + info['offset']
+            end = begin + dtype.itemsize * int(np.prod(shape))
+            self._columns[name] = self._map[begin:end].view(dtype).reshape(shape)
+
+    def __len__(self):
+        return self._count
+
+    def __getattr__(self, name):
+        # numeric columns as thickness, left_r, right_coefs, ...
+        columns = self.__dict__.get('_columns', {})
+        key = name.replace('_', '.', 1) if name.startswith(('left_', 'right_')) else name
+        if key in columns and key not in _texts:
+            return columns[key]
+        raise AttributeError(name)
+
+    def column(self, name):
+        """
+        Column by name as in LensTable.column(), texts are decoded
+        """
+        if name in _texts:
+            return self._text(name, slice(None))
+        if name not in self._columns or name.startswith('string_'):
+            raise KeyError(name)
+        return self._columns[name]
+
+    def __getitem__(self, index):
+        if np.ndim(index) == 0 and not isinstance(index, slice):
+            i = int(index)
+            if not -len(self) <= i < len(self):
+                raise IndexError("lens index out of range")
+            i %= len(self)
+
+            row = slice(i, i+1)
+            lens = Lens(self._batch('left', row)[0], self._batch('right', row)[0],
+                        self._string(self._columns['name'][i]),
+                        float(self._columns['thickness'][i]),
+                        self._string(self._columns['material'][i]))
+            lens.description = self._string(self._columns['description'][i])
+            return lens
+
+        return LensTable(self._batch('left', index), self._batch('right', index),
+                         np.array(self._columns['thickness'][index]),
+                         **{t: self._text(t, index) for t in _texts})
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def to_table(self):
+        return self[:]
+
+    def _batch(self, side, index):
+        col = {name: np.array(self._columns[side + '.' + name][index])
+               for name, _ in _surface_columns}
+        return s.SurfaceBatch(**col)
+
+    def _string(self, j):
+        offsets = self._columns['string_offsets']
+        data = self._columns['string_data'][offsets[j]:offsets[j+1]]
+        return bytes(data).decode('utf-8')
+
+    def _text(self, column, index):
+        ids, inverse = np.unique(self._columns[column][index], return_inverse=True)
+        strings = np.array([self._string(j) for j in ids] or [''], dtype=object)
+        return strings[inverse.reshape(-1)]
+
+
+def _aligned(offset):
+    return -(-offset // _align) * _align
@@ -0,0 +1,364 @@
+""" Module for glass materials and their catalogs
+"""
+
+"""
+    Copyright (C) 2020 Hiiragi <heterophyllus.work@gmail.com>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+class Material:
+    """
+    Glass data of a catalog entry
+
+    Args:
+        name(str): glass name
+        density(float): density in g/cm^3
+        nd(float): refractive index at the d line
+        vd(float): Abbe number
+        formula(int): dispersion formula number as in AGF files
+        coefs: dispersion coefficients
+        catalog(str): name of the catalog the glass comes from
+    """
+
+    def __init__(self, name, density=np.nan, nd=np.nan, vd=np.nan, formula=0, coefs=(), catalog=''):
+        self.name = name
+        self.density = float(density)
+        self.nd = float(nd)
+        self.vd = float(vd)
+        self.formula = int(formula)
+        self.coefs = tuple(float(a) for a in coefs)
+        self.catalog = catalog
+
+    def __repr__(self):
+        return "Material({!r}, density={}, nd={}, vd={})".format(self.name, self.density, self.nd, self.vd)
+
+    def index(self, wavelength):
+        """
+        Refractive index from the dispersion formula
+
+        Args:
+            wavelength: wavelength in um, scalar or array
+        """
+        if self.formula not in _formulas:
+            raise ValueError("unknown dispersion formula {} of {}".format(self.formula, self.name))
+
+        a = np.zeros(max(len(self.coefs), 10))
+        a[:len(self.coefs)] = self.coefs
+        return _formulas[self.formula](np.asarray(wavelength, dtype=float), a)
+
+    def to_dict(self):
+        return {'name': self.name, 'density': self.density, 'nd': self.nd, 'vd': self.vd,
+                'formula': self.formula, 'coefs': list(self.coefs), 'catalog': self.catalog}
+
+    @classmethod
+    def from_dict(cls, dct):
+        return cls(**dct)
+
+
+def _schott(w, a):
+    w2 = w*w
+    return np.sqrt(a[0] + a[1]*w2 + a[2]/w2 + a[3]/w2**2 + a[4]/w2**3 + a[5]/w2**4)
+
+
+def _sellmeier(terms):
+    def formula(w, a):
+        w2 = w*w
+        n2 = 1.0
+        for j in range(terms):
+            n2 = n2 + a[2*j]*w2/(w2 - a[2*j+1])
+        return np.sqrt(n2)
+    return formula
+
+
+def _herzberger(w, a):
+    w2 = w*w
+    L = 1/(w2 - 0.028)
+    return a[0] + a[1]*L + a[2]*L**2 + a[3]*w2 + a[4]*w2**2 + a[5]*w2**3
+
+
+def _sellmeier2(w, a):
+    w2 = w*w
+    return np.sqrt(1 + a[0] + a[1]*w2/(w2 - a[2]**2) + a[3]/(w2 - a[4]**2))
+
+
+def _handbook1(w, a):
+    w2 = w*w
+    return np.sqrt(a[0] + a[1]/(w2 - a[2]) - a[3]*w2)
+
+
+def _handbook2(w, a):
+    w2 = w*w
+    return np.sqrt(a[0] + a[1]*w2/(w2 - a[2]) - a[3]*w2)
+
+
+def _sellmeier4(w, a):
+    w2 = w*w
+    return np.sqrt(a[0] + a[1]*w2/(w2 - a[2]) + a[3]*w2/(w2 - a[4]))
+
+
+def _conrady(w, a):
+    return a[0] + a[1]/w + a[2]/w**3.5
+
+
+def _extended(w, a):
+    w2 = w*w
+    return np.sqrt(_schott(w, a)**2 + a[6]/w2**5 + a[7]/w2**6)
+
+
+def _extended2(w, a):
+    w2 = w*w
+    return np.sqrt(_schott(w, a)**2 + a[6]*w2**2 + a[7]*w2**3)
+
+
+def _extended3(w, a):
+    w2 = w*w
+    return np.sqrt(a[0] + a[1]*w2 + a[2]*w2**2 + a[3]/w2 + a[4]/w2**2 + a[5]/w2**3
+                   + a[6]/w2**4 + a[7]/w2**5 + a[8]/w2**6)
+
+
+# dispersion formulas by their number in AGF files, wavelength in um
+_formulas = {
+    1: _schott,
+    2: _sellmeier(3),
+    3: _herzberger,
+    4: _sellmeier2,
+    5: _conrady,
+    6: _sellmeier(4),
+    7: _handbook1,
+    8: _handbook2,
+    9: _sellmeier4,
+    10: _extended,
+    11: _sellmeier(5),
+    12: _extended2,
+    13: _extended3,
+}
+
+
+def read_agf(filepath):
+    """
+    Reads the glasses of a Zemax AGF catalog file
+
+    Only NM (name, formula, nd, vd), ED (density) and CD (dispersion
+    coefficients) records are used. A glass with a formula number other
+    than 1 to 13 raises ValueError.
+
+    Returns:
+        list of Material
+    """
+    with open(filepath, 'rb') as f:
+        raw = f.read()
+    if raw.startswith((b'\xff\xfe', b'\xfe\xff')):
+        text = raw.decode('utf-16')
+    else:
+        try:
+            text = raw.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            text = raw.decode('latin-1')
+
+    catalog = os.path.splitext(os.path.basename(filepath))[0]
+    materials = []
+    fields = None
+
+    for line in text.splitlines():
+        words = line.split()
+        if len(words) == 0:
+            continue
+
+        if words[0] == 'NM':
+            if fields is not None:
+                materials.append(Material(**fields))
+            fields = {'name': words[1], 'catalog': catalog,
+                      'formula': int(float(_word(words, 2, 0))),
+                      'nd': _word(words, 4, np.nan), 'vd': _word(words, 5, np.nan)}
+            if fields['formula'] not in _formulas:
+                raise ValueError("{}: unknown dispersion formula {} of {}".format(
+                    filepath, fields['formula'], fields['name']))
+        elif fields is None:
+            continue
+        elif words[0] == 'ED':
+            density = float(_word(words, 3, np.nan))
+            fields['density'] = density if density > 0 else np.nan
+        elif words[0] == 'CD':
+            fields['coefs'] = [float(x) for x in words[1:]]
+
+    if fields is not None:
+        materials.append(Material(**fields))
+
+    return materials
+
+
+def _word(words, i, default):
+    return words[i] if len(words) > i else default
+
+
+def _key(name):
+    return name.strip().upper()
+
+
+class MaterialCatalog:
+    """
+    Case-insensitive lookup of materials by name or alias
+
+    Catalog files are parsed once; the result is cached as JSON in
+    cache_dir and reused while the file has the same modification time and
+    size, or else the same SHA-1.
+
+    Args:
+        materials: initial list of Material
+        aliases(dict): alias -> material name
+        cache_dir(str): directory of the parsed catalogs, no cache if None
+    """
+
+    def __init__(self, materials=(), aliases=None, cache_dir=None):
+        self.cache_dir = cache_dir
+        self._materials = {}
+        self._aliases = {}
+        for material in materials:
+            self.add(material)
+        for alias, name in (aliases or {}).items():
+            self.add_alias(alias, name)
+
+    def __len__(self):
+        return len(self._materials)
+
+    def __iter__(self):
+        return iter(self._materials.values())
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __getitem__(self, name):
+        material = self.get(name)
+        if material is None:
+            raise KeyError(name)
+        return material
+
+    def get(self, name, default=None):
+        """
+        Material by name or alias, ignoring case and surrounding spaces
+
+        name may also be any object with a material attribute, such as a
+        Lens or a Singlet.
+        """
+        if not isinstance(name, str):
+            name = name.material
+        key = _key(name)
+        key = self._aliases.get(key, key)
+        return self._materials.get(key, default)
+
+    def add(self, material):
+        """ adds or replaces a material
+        """
+        self._materials[_key(material.name)] = material
+
+    def add_alias(self, alias, name):
+        self._aliases[_key(alias)] = _key(name)
+
+    def density(self, name):
+        """ density in g/cm^3, nan if unknown
+        """
+        material = self.get(name)
+        if material is None:
+            return np.nan
+        return material.density
+
+    def load(self, filepath):
+        """
+        Adds the materials of an AGF file, through the cache if possible
+
+        Returns:
+            number of materials loaded
+        """
+        materials = self._cached(filepath)
+        if materials is None:
+            materials = read_agf(filepath)
+            self._store(filepath, materials)
+
+        for material in materials:
+            self.add(material)
+
+        return len(materials)
+
+    def _cache_path(self, filepath):
+        key = hashlib.sha1(os.path.abspath(filepath).encode('utf-8')).hexdigest()[:16]
+        name = os.path.splitext(os.path.basename(filepath))[0]
+        return os.path.join(self.cache_dir, '{}-{}.json'.format(name, key))
+
+    def _cached(self, filepath):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._cache_path(filepath)) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        stat = os.stat(filepath)
+        if (cache['mtime'], cache['size']) != (stat.st_mtime, stat.st_size):
+            # touched but maybe not changed
+            if cache['sha1'] != _sha1(filepath):
+                return None
+            cache['mtime'], cache['size'] = stat.st_mtime, stat.st_size
+            self._write_cache(filepath, cache)
+
+        return [Material.from_dict(dct) for dct in cache['materials']]
+
+    def _store(self, filepath, materials):
+        if self.cache_dir is None:
+            return
+        stat = os.stat(filepath)
+        cache = {'mtime': stat.st_mtime, 'size': stat.st_size, 'sha1': _sha1(filepath),
+                 'materials': [material.to_dict() for material in materials]}
+        self._write_cache(filepath, cache)
+
+    def _write_cache(self, filepath, cache):
+        # a cache that cannot be written only costs parsing next time
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._cache_path(filepath)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(cache, f)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            pass
+
+
+def _sha1(filepath):
+    h = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+# density [g/cm^3] of common glasses, used until a catalog is loaded
+catalog = MaterialCatalog(
+    [Material('N-BK7', 2.51),
+     Material('S-BSL7', 2.52),
+     Material('N-BAK4', 3.05),
+     Material('N-SF10', 3.05),
+     Material('N-SF11', 3.22),
+     Material('N-F2', 2.65),
+     Material('F_SILICA', 2.20),
+     Material('CAF2', 3.18)],
+    aliases={'BK7': 'N-BK7', 'BSL7': 'S-BSL7', 'FUSED SILICA': 'F_SILICA', 'SILICA': 'F_SILICA'},
+    cache_dir=os.path.join(os.path.expanduser('~'), '.cache', 'lens-drawing'))
@@ -0,0 +1,224 @@
+""" Module for searching lens collections
+"""
+
+"""
+    Copyright (C) 2020 Hiiragi <heterophyllus.work@gmail.com>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Example:
+
+    index = LensIndex(table)
+    rows = index.select(Field('left.r').between(20, 30)
+                        & Field('left.outer_d').near(12, 0.5)
+                        & (Field('material') == 'N-BK7'))
+"""
+
+import numpy as np
+from lens import LensTable
+
+
+numeric_fields = ('thickness',
+                  'left.r', 'left.inner_d', 'left.outer_d',
+                  'right.r', 'right.inner_d', 'right.outer_d')
+text_fields = ('name', 'material')
+
+
+class LensIndex:
+    """
+    Sorted and hash indexes over a lens collection
+
+    Numeric fields are kept sorted with their row numbers, so a range is
+    found by two binary searches. Text fields map each distinct value,
+    stripped and case-insensitive, to its rows. Building the index is a
+    single pass of sorting; the collection must not change afterwards.
+
+    Args:
+        lenses: LensTable, LensLibrary or list of Lens
+        numeric: names of the numeric fields to index
+        text: names of the text fields to index
+    """
+
+    def __init__(self, lenses, numeric=numeric_fields, text=text_fields):
+        if isinstance(lenses, (list, tuple)):
+            lenses = LensTable.from_lenses(lenses)
+        self.lenses = lenses
+        self._n = len(lenses)
+
+        self._sorted = {}
+        for field in numeric:
+            values = np.asarray(lenses.column(field), dtype=float)
+            order = np.argsort(values, kind='stable')
+            self._sorted[field] = (values[order], order)
+
+        self._hashed = {}
+        for field in text:
+            keys, codes = np.unique(_normalize(lenses.column(field)), return_inverse=True)
+            codes = codes.reshape(-1)
+            order = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[order], np.arange(len(keys)+1))
+            self._hashed[field] = {str(key): order[bounds[j]:bounds[j+1]]
+                                   for j, key in enumerate(keys)}
+
+    def __len__(self):
+        return self._n
+
+    def select(self, predicate):
+        """ sorted row numbers matching the predicate
+        """
+        return np.flatnonzero(predicate.mask(self))
+
+    def find(self, predicate):
+        """ matching lenses as a LensTable
+        """
+        return self.lenses[self.select(predicate)]
+
+    def _range(self, field, lo, hi, lo_closed, hi_closed):
+        if field not in self._sorted:
+            raise KeyError("field is not indexed: {}".format(field))
+
+        values, order = self._sorted[field]
+        i = np.searchsorted(values, lo, side='left' if lo_closed else 'right')
+        j = np.searchsorted(values, hi, side='right' if hi_closed else 'left')
+        return self._mask(order[i:j])
+
+    def _equal(self, field, value):
+        if field in self._sorted:
+            return self._range(field, value, value, True, True)
+        if field not in self._hashed:
+            raise KeyError("field is not indexed: {}".format(field))
+
+        rows = self._hashed[field].get(str(_normalize(value)))
+        if rows is None:
+            return np.zeros(self._n, dtype=bool)
+        return self._mask(rows)
+
+    def _mask(self, rows):
+        mask = np.zeros(self._n, dtype=bool)
+        mask[rows] = True
+        return mask
+
+
+class Predicate:
+    """
+    Condition on lenses, combined with & (and), | (or) and ~ (not)
+    """
+
+    def mask(self, index):
+        """ boolean array over the rows of a LensIndex
+        """
+        raise NotImplementedError()
+
+    def __and__(self, other):
+        return _Combined(np.logical_and, self, other)
+
+    def __or__(self, other):
+        return _Combined(np.logical_or, self, other)
+
+    def __invert__(self):
+        return _Not(self)
+
+
+class Field:
+    """
+    Indexed field of a lens, creating predicates on it
+
+    Numeric fields support ==, <, <=, >, >=, between() and near(); text
+    fields support == and isin().
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __eq__(self, value):
+        return _Equal(self.name, value)
+
+    def __lt__(self, value):
+        return _Range(self.name, -np.inf, value, True, False)
+
+    def __le__(self, value):
+        return _Range(self.name, -np.inf, value, True, True)
+
+    def __gt__(self, value):
+        return _Range(self.name, value, np.inf, False, True)
+
+    def __ge__(self, value):
+        return _Range(self.name, value, np.inf, True, True)
+
+    __hash__ = None
+
+    def between(self, lo, hi):
+        """ lo <= value <= hi
+        """
+        return _Range(self.name, lo, hi, True, True)
+
+    def near(self, value, tol):
+        """ value - tol <= value <= value + tol
+        """
+        return _Range(self.name, value - tol, value + tol, True, True)
+
+    def isin(self, values):
+        return _Any([_Equal(self.name, value) for value in values])
+
+
+class _Range(Predicate):
+    def __init__(self, field, lo, hi, lo_closed, hi_closed):
+        self.args = (field, float(lo), float(hi), lo_closed, hi_closed)
+
+    def mask(self, index):
+        return index._range(*self.args)
+
+
+class _Equal(Predicate):
+    def __init__(self, field, value):
+        self.field = field
+        self.value = value
+
+    def mask(self, index):
+        return index._equal(self.field, self.value)
+
+
+class _Combined(Predicate):
+    def __init__(self, op, a, b):
+        self.op = op
+        self.a = a
+        self.b = b
+
+    def mask(self, index):
+        return self.op(self.a.mask(index), self.b.mask(index))
+
+
+class _Any(Predicate):
+    def __init__(self, predicates):
+        self.predicates = predicates
+
+    def mask(self, index):
+        mask = np.zeros(len(index), dtype=bool)
+        for p in self.predicates:
+            mask |= p.mask(index)
+        return mask
+
+
+class _Not(Predicate):
+    def __init__(self, predicate):
+        self.predicate = predicate
+
+    def mask(self, index):
+        return ~self.predicate.mask(index)
+
+
+def _normalize(text):
+    return np.char.upper(np.char.strip(np.asarray(text, dtype=str)))
@@ -19,13 +19,268 @@
 
 """
 
+import threading
+from collections import OrderedDict
+
 import numpy as np
 
+
+def _conic(c, k, h, order):
+    """ conic base sag and its derivatives, sharing one square root
+    """
+    h2 = h*h
+    rt = np.sqrt(1.0 - (1.0+k) * c**2 * h2)
+
+    terms = [c*h2 / (1.0 + rt)]
+    if order >= 1:
+        terms.append(c*h / rt)
+    if order >= 2:
+        terms.append(c / rt**3)
+
+    return terms
+
+
+def _polynomial(coefs, h, order, p0, step):
+    """ sum of A_j*h**(p0 + step*j) and its derivatives by Horner's method
+
+    The three sums are accumulated in the same loop over the coefficients,
+    in powers of x = h**step. coefs may also be 2-D, one row of
+    coefficients per row of h.
+    """
+    coefs = np.asarray(coefs, dtype=float)
+    if coefs.ndim == 1:
+        coefs = np.trim_zeros(coefs, 'b')
+        n = len(coefs)
+        column = lambda j: coefs[j]
+    else:
+        nonzero = np.flatnonzero(coefs.any(axis=0))
+        n = nonzero[-1]+1 if len(nonzero) > 0 else 0
+        column = lambda j: coefs[:, j, np.newaxis]
+    x = h**step
+
+    q0 = q1 = q2 = 0.0
+    for j in range(n-1, -1, -1):
+        A = column(j)
+        p = p0 + step*j
+        q0 = q0*x + A
+        if order >= 1:
+            q1 = q1*x + p*A
+        if order >= 2:
+            q2 = q2*x + p*(p-1)*A
+
+    terms = [q0 * h**p0]
+    if order >= 1:
+        terms.append(q1 * h**(p0-1))
+    if order >= 2:
+        terms.append(q2 * h**(p0-2))
+
+    return terms
+
+
+def _inverse_sag(evaluate, z, c, k, h_max, iterations, tol):
+    """ heights in [0, h_max] where the sag reaches z
+
+    Newton steps with the analytic 1st derivative, falling back to
+    bisection whenever a step leaves the bracket. The sag is assumed to be
+    monotonic on [0, h_max]; z out of its range gives nan.
+    """
+    z = np.asarray(z, dtype=float)
+    lo = np.zeros(np.broadcast(z, h_max).shape)
+    hi = lo + h_max
+    z = z + lo
+
+    f_lo = evaluate(lo, 0)[0] - z
+    f_hi = evaluate(hi, 0)[0] - z
+    valid = f_lo*f_hi <= 0
+
+    # start from the inverse of the conic part
+    with np.errstate(invalid='ignore', divide='ignore'):
+        h = np.sqrt(z*(2 - c*(1+k)*z)/c)
+    h = np.where((h >= lo) & (h <= hi), h, (lo+hi)/2)
+    h = np.where(np.abs(f_hi) <= tol, hi, h)
+
+    for _ in range(iterations):
+        f, df = evaluate(h, 1)
+        f = f - z
+        done = np.abs(f) <= tol
+        if np.all(done | ~valid):
+            break
+
+        same = np.sign(f) == np.sign(f_lo)
+        lo = np.where(same, h, lo)
+        f_lo = np.where(same, f, f_lo)
+        hi = np.where(same, hi, h)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            step = h - f/df
+        step = np.where((step >= lo) & (step <= hi), step, (lo+hi)/2)
+        h = np.where(done, h, step)
+
+    return np.where(valid, h, np.nan)
+
+
+def _max_semi_aperture(evaluate, c, k, h_search, max_slope, n_probe):
+    """ largest height where the profile is defined, as arrays
+
+    The closed form limit of the conic comes from (1+k)*c^2*h^2 <= 1. With
+    max_slope [deg], it is lowered to the first height within h_search
+    where the slope including the polynomial terms reaches max_slope.
+    """
+    q = (1+k) * c**2
+    with np.errstate(divide='ignore'):
+        h_lim = np.where(q > 0, 1/np.sqrt(np.abs(q)), np.inf)
+
+    if max_slope is None:
+        return h_lim
+
+    top = np.minimum(h_lim*(1 - 1e-12), h_search)
+    top = np.where(np.isfinite(top), top, 0.0)
+    hp = top[:, np.newaxis] * np.linspace(0.0, 1.0, n_probe)
+    steep = np.abs(_slope(evaluate(hp, 1)[1])) >= max_slope
+
+    # bisect between the last probe below and the first one above max_slope
+    found = steep.any(axis=1)
+    i = np.maximum(steep.argmax(axis=1), 1)
+    rows = np.arange(len(top))
+    lo = hp[rows, i-1]
+    hi = hp[rows, i]
+    for _ in range(50):
+        mid = (lo + hi)/2
+        above = np.abs(_slope(evaluate(mid[:, np.newaxis], 1)[1][:, 0])) >= max_slope
+        lo = np.where(above, lo, mid)
+        hi = np.where(above, mid, hi)
+
+    return np.where(found, hi, h_lim)
+
+
+def _sphere_slope(c, h):
+    return np.degrees(np.arcsin(c*h))
+
+
+def _sphere_semi_aperture(c, h_search, max_slope):
+    with np.errstate(divide='ignore'):
+        h_lim = 1/np.abs(c)
+    if max_slope is None:
+        return h_lim
+
+    h_slope = np.sin(np.radians(min(max_slope, 90.0))) * h_lim
+    return np.where(h_slope <= h_search, h_slope, h_lim)
+
+
+def _sphere_inverse_sag(c, z, h_max):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        h = np.sqrt(z*(2 - c*z)/c)
+
+    # only the hemisphere up to h_max is searched, a flat reaches 0 at the vertex
+    reached = (np.abs(c*z) <= 1) & (h <= h_max*(1 + 1e-12))
+    h = np.where(reached, np.minimum(h, h_max), np.nan)
+    return np.where((c == 0) & (z == 0), 0.0, h)
+
+
+def _best_fit_sphere(h, z, w):
+    """ curvature and vertex position of the least-squares sphere, row-wise
+
+    The sphere A*(h^2 + z^2) - 2*z + C = 0 is linear in (A, C), so the
+    weighted algebraic residual is minimized by 2x2 normal equations,
+    solved for all rows at once.
+    """
+    q = h**2 + z**2
+    m = np.empty(h.shape[:1] + (2, 2))
+    m[:, 0, 0] = np.sum(w*q*q, axis=1)
+    m[:, 0, 1] = m[:, 1, 0] = np.sum(w*q, axis=1)
+    m[:, 1, 1] = np.sum(w, axis=1)
+    rhs = 2*np.stack((np.sum(w*q*z, axis=1), np.sum(w*z, axis=1)), axis=1)
+
+    singular = ~(np.abs(np.linalg.det(m)) > 0)
+    m[singular] = np.eye(2)
+    A, C = np.linalg.solve(m, rhs[:, :, np.newaxis])[:, :, 0].T
+
+    z0 = C/(1 + np.sqrt(1 - A*C))
+    c = A/(1 - A*z0)
+
+    return np.where(singular, np.nan, c), np.where(singular, np.nan, z0)
+
+
+def _hermite(z, z1, step, r):
+    """ cubic Hermite interpolation of a radial table with spacing step
+    """
+    t = r/step
+    i = np.minimum(t.astype(np.intp), len(z)-2)
+    u = t - i
+    v = 1 - u
+
+    return (v*v*(1 + 2*u)*z[i] + u*v*v*step*z1[i]
+            + u*u*(3 - 2*u)*z[i+1] - u*u*v*step*z1[i+1])
+
+
+def _slope(z1):
+    return np.arctan(z1)*180/np.pi
+
+
+def _local_curvature(z1, z2):
+    return z2 / np.power(1 + z1**2, 3/2)
+
+
+def _local_radius(z1, z2):
+    with np.errstate(divide='ignore'):
+        return 1/_local_curvature(z1, z2)
+
+
 class Surface:
+    """
+    Base class of the surface profiles
+
+    Surfaces are immutable; use replace() to derive a modified copy. They
+    compare and hash by content, so they can be shared between threads and
+    used as dict keys.
+    """
+
+    __slots__ = ('r', 'inner_d', 'outer_d', '_hash')
+
+    type = None
+    _fields = ('r', 'inner_d', 'outer_d')
+
     def __init__(self, r=np.inf, inner_d=0.0, outer_d=0.0):
-        self.inner_d = inner_d
-        self.outer_d = outer_d
-        self.r = r
+        object.__setattr__(self, 'r', float(r))
+        object.__setattr__(self, 'inner_d', float(inner_d))
+        object.__setattr__(self, 'outer_d', float(outer_d))
+        object.__setattr__(self, '_hash', hash((self.profile_key(), self.inner_d, self.outer_d)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("{} is immutable, use replace()".format(type(self).__name__))
+
+    def __delattr__(self, name):
+        raise AttributeError("{} is immutable".format(type(self).__name__))
+
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return NotImplemented
+        return (self._hash == other._hash and
+                self.profile_key() == other.profile_key() and
+                self.inner_d == other.inner_d and
+                self.outer_d == other.outer_d)
+
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        return (type(self), tuple(getattr(self, f) for f in self._fields))
+
+    def __repr__(self):
+        params = ', '.join('{}={!r}'.format(f, getattr(self, f)) for f in self._fields)
+        return '{}({})'.format(type(self).__name__, params)
+
+    def parameters(self):
+        """ constructor arguments as a dict
+        """
+        return {f: getattr(self, f) for f in self._fields}
+
+    def replace(self, **changes):
+        """ returns a copy with the given parameters changed
+        """
+        params = self.parameters()
+        params.update(changes)
+        return type(self)(**params)
 
     @property
     def c(self):
@@ -39,196 +294,685 @@ class Surface:
                 _c = np.inf
         return _c
 
-    def sag(self,h):
-        pass
+    def profile_key(self):
+        """ hashable key of the parameters the profile depends on
+        """
+        return (self.type, self.r)
+
+    def evaluate(self, h, order=2):
+        """
+        Computes sag and its derivatives together
+
+        Args:
+            h: height, scalar or array
+            order(int): highest derivative to compute (0, 1 or 2)
+
+        Returns:
+            tuple of sag, 1st and 2nd derivative, up to the given order
+        """
+        raise NotImplementedError
+
+    def sag(self, h):
+        return self.evaluate(h, 0)[0]
 
     def deriv_1st(self, h):
-        pass
+        return self.evaluate(h, 1)[1]
 
     def deriv_2nd(self, h):
-        pass
+        return self.evaluate(h, 2)[2]
 
     def slope(self, h):
-        pass
+        return _slope(self.deriv_1st(h))
 
     def local_curvature(self, h):
-        pass
+        _, z1, z2 = self.evaluate(h, 2)
+        return _local_curvature(z1, z2)
 
     def local_radius(self, h):
-        pass
+        _, z1, z2 = self.evaluate(h, 2)
+        return _local_radius(z1, z2)
+
+    def profile(self, h):
+        """
+        Returns sag, slope and local radius from a single evaluation
+        """
+        z, z1, z2 = self.evaluate(h, 2)
+        return z, _slope(z1), _local_radius(z1, z2)
+
+    def max_semi_aperture(self, max_slope=None, h_search=None, n_probe=257):
+        """
+        Largest height where the profile is valid
+
+        Without max_slope this is the closed form limit of the conic,
+        beyond which the sag is nan (inf if there is none). With max_slope
+        [deg], the limit is lowered to the first height within h_search
+        (outer_d/2 by default) where the slope reaches max_slope.
+        """
+        if h_search is None:
+            h_search = self.outer_d/2
+        k = getattr(self, 'k', 0.0)
+        return float(_max_semi_aperture(self.evaluate, np.array([self.c]), k,
+                                        h_search, max_slope, n_probe)[0])
+
+    def best_fit_sphere(self, semi_aperture=None, n=256):
+        """
+        Least-squares sphere over the aperture, see SurfaceBatch.best_fit_sphere
+
+        Returns:
+            radius and vertex position of the sphere
+        """
+        radius, z0 = SurfaceBatch.from_surfaces([self]).best_fit_sphere(semi_aperture, n)
+        return radius[0], z0[0]
+
+    def departure(self, h, semi_aperture=None, n=256):
+        """
+        Departure from the best-fit sphere at height h
+        """
+        d = SurfaceBatch.from_surfaces([self]).departure(np.ravel(h), semi_aperture, n)[0]
+        if np.ndim(h) == 0:
+            return float(d[0])
+        return d.reshape(np.shape(h))
+
+    def inverse_sag(self, z, h_max=None, iterations=20, tol=1e-12):
+        """
+        Height where the sag reaches z
+
+        Args:
+            z: sag, scalar or array
+            h_max(float): upper end of the searched range, inner_d/2 by default
+            iterations(int): maximum number of Newton steps
+            tol(float): tolerance of the sag
+
+        Returns:
+            height in [0, h_max], nan where z is not reached
+        """
+        if h_max is None:
+            h_max = self.inner_d/2
+        if h_max <= 0.0:
+            raise ValueError("h_max must be positive")
+
+        k = getattr(self, 'k', 0.0)
+        h = _inverse_sag(self.evaluate, z, self.c, k, h_max, iterations, tol)
+        if np.ndim(z) == 0:
+            return float(h)
+        return h
+
+    def sample(self, h_min, h_max, tolerance=0.001, n_probe=257):
+        """
+        Heights for drawing the profile as a polyline
+
+        Points are spaced so that the chordal error of every segment is
+        about the given tolerance: the local curvature is probed on a
+        uniform grid and the points are distributed with density
+        proportional to the square root of the curvature per arc length.
+
+        Args:
+            h_min, h_max: range of height
+            tolerance(float): allowed deviation between chord and profile
+            n_probe(int): number of points the curvature is probed at
+
+        Returns:
+            heights including both ends
+        """
+        hp = np.linspace(h_min, h_max, n_probe)
+        _, z1, z2 = self.evaluate(hp, 2)
+        ds = np.sqrt(1 + z1**2)
+        kappa = np.abs(_local_curvature(z1, z2))
+
+        # chordal error of a segment of arc length L is kappa*L^2/8
+        density = np.nan_to_num(ds * np.sqrt(kappa/(8*tolerance)))
+        count = np.concatenate(([0.0], np.cumsum((density[1:] + density[:-1])/2 * np.diff(hp))))
+
+        n_seg = max(1, int(np.ceil(count[-1])))
+        h = np.interp(np.linspace(0.0, count[-1], n_seg+1), count, hp)
+        h[0], h[-1] = h_min, h_max
+
+        return h
+
+    def sag_grid(self, nx, ny, extent, dtype=float, n_radial=4097, chunk_rows=256):
+        """
+        Sag on a rectangular grid of x and y
+
+        The profile is evaluated once on a radial table and interpolated by
+        cubic Hermite polynomials using the 1st derivative. If the grid is
+        symmetric about an axis, only one half is computed and mirrored.
+
+        Args:
+            nx, ny(int): number of points along x and y
+            extent: (xmin, xmax, ymin, ymax), or half width of a centered square
+            dtype: dtype of the result, e.g. np.float32 to halve the memory
+            n_radial(int): number of points of the radial table
+            chunk_rows(int): number of rows interpolated at once
+
+        Returns:
+            (ny, nx) array z[iy, ix] at x = linspace(xmin, xmax, nx) and
+            y = linspace(ymin, ymax, ny)
+        """
+        if np.ndim(extent) == 0:
+            extent = (-extent, extent, -extent, extent)
+        x = np.linspace(extent[0], extent[1], nx)
+        y = np.linspace(extent[2], extent[3], ny)
+
+        step = np.hypot(np.abs(x).max(), np.abs(y).max())/(n_radial - 1)
+        if step == 0.0:
+            return np.full((ny, nx), self.sag(0.0), dtype=dtype)
+        z, z1 = self.evaluate(step*np.arange(n_radial), 1)
+
+        sym_x = _symmetric(x)
+        sym_y = _symmetric(y)
+        cols = np.arange(nx//2 if sym_x else 0, nx)
+        rows = np.arange(ny//2 if sym_y else 0, ny)
+
+        grid = np.empty((ny, nx), dtype=dtype)
+        x2 = x[cols]**2
+        for i in range(0, len(rows), chunk_rows):
+            r = rows[i:i+chunk_rows]
+            rho = np.sqrt(y[r, np.newaxis]**2 + x2)
+            grid[r[0]:r[-1]+1, cols[0]:] = _hermite(z, z1, step, rho)
+
+        if sym_x:
+            grid[:, :nx//2] = grid[:, nx-1:(nx-1)//2:-1]
+        if sym_y:
+            grid[:ny//2] = grid[ny-1:(ny-1)//2:-1]
+
+        return grid
 
     def print_data(self,h):
+        sag, slope, local_r = self.profile(np.asarray(h, dtype=float))
         print('{:>5}'.format('h'), '{:>5}'.format('sag'), '{:>5}'.format('slope'),'{:>5}'.format('localR'))
-        for hh in h:
-            print('{0:.4f} {1:.4f} {2:.4f} {3:.4f}'.format(hh, self.sag(hh), self.slope(hh), self.local_radius(hh)))
+        for i, hh in enumerate(h):
+            print('{0:.4f} {1:.4f} {2:.4f} {3:.4f}'.format(hh, sag[i], slope[i], local_r[i]))
 
 
 
 class Sphere(Surface):
-    def __init__(self, r=np.inf, inner_d=0.0, outer_d=0.0):
-        super().__init__(inner_d, outer_d)
-        self.type = 'SPH'
-        self.r = r
+    __slots__ = ()
 
-    def sag(self, h):
-        z = self.c* h**2 / ( 1 + np.sqrt(1 - self.c**2 * h**2) )
-        return z
-
-    def deriv_1st(self, h):
-        c = self.c
-        rt = np.sqrt( 1 -  c**2 * h**2 )
+    type = 'SPH'
 
-        z1 = 2*c*h/( rt+1 )
-        z2 = c**3 * h**3 /( rt * (rt+1)**2 )
-
-        return (z1+z2)
-
-    def deriv_2nd(self, h):
-        pass
+    def evaluate(self, h, order=2):
+        return tuple(_conic(self.c, 0.0, h, order))
 
-    def slope(self,h):
-        return (np.arctan(self.deriv_1st(h)))*180/np.pi
+    def slope(self, h):
+        return _sphere_slope(self.c, h)
 
     def local_curvature(self,h):
-        return 1/self.local_radius(h)
+        return self.c + np.zeros_like(h)
 
     def local_radius(self,h):
         return self.r + np.zeros_like(h)
 
+    def profile(self, h):
+        return self.sag(h), self.slope(h), self.local_radius(h)
+
+    def max_semi_aperture(self, max_slope=None, h_search=None, n_probe=257):
+        if h_search is None:
+            h_search = self.outer_d/2
+        return float(_sphere_semi_aperture(self.c, h_search, max_slope))
+
+    def inverse_sag(self, z, h_max=None, iterations=20, tol=1e-12):
+        if h_max is None:
+            h_max = self.inner_d/2
+        if h_max <= 0.0:
+            raise ValueError("h_max must be positive")
+
+        h = _sphere_inverse_sag(self.c, np.asarray(z, dtype=float), h_max)
+        if np.ndim(z) == 0:
+            return float(h)
+        return h
+
+
+class _Asphere(Surface):
+    """ conic with polynomial terms, common part of EvenAsphere and OddAsphere
+    """
 
-class EvenAsphere(Surface):
-    def __init__(self, r= np.inf, k=0.0, coefs=None, inner_d=0.0, outer_d=0.0):
-        super().__init__(inner_d, outer_d)
+    __slots__ = ('k', 'coefs')
 
-        self.type = 'ASP'
-        self.r = r
-        self.k = k
+    _fields = ('r', 'k', 'coefs', 'inner_d', 'outer_d')
 
+    def __init__(self, r=np.inf, k=0.0, coefs=None, inner_d=0.0, outer_d=0.0):
         if coefs is None:
-            self.coefs = np.zeros(9,dtype=float)
+            coefs = np.zeros(9,dtype=float)
         else:
-            self.coefs = coefs
+            coefs = np.array(coefs, dtype=float)
+        coefs.setflags(write=False)
+
+        object.__setattr__(self, 'k', float(k))
+        object.__setattr__(self, 'coefs', coefs)
+        super().__init__(r, inner_d, outer_d)
 
     def get_parameters(self):
         return self.r, self.k, self.coefs
 
-    def sag(self, h):
-        z_conic = self.c*np.power(h,2.0) /(1.0 + np.sqrt(1-(1+self.k)*np.power(self.c,2.0)*np.power(h,2.0)))
+    def profile_key(self):
+        # trailing zeros trimmed on the list, np.trim_zeros is slow on short arrays
+        coefs = self.coefs.tolist()
+        while coefs and coefs[-1] == 0.0:
+            coefs.pop()
+        return (self.type, self.r, self.k, tuple(coefs))
 
-        z_pol = 0.0
-        for i, A in enumerate(self.coefs):
-            z_pol += A*h**(2*(i+1)+2)
 
-        return (z_conic + z_pol)
+class EvenAsphere(_Asphere):
+    __slots__ = ()
 
-    def deriv_1st(self, h):
-        c = self.c
-        k = self.k
-        rt = np.sqrt( 1 - (1+k) * c**2 * h**2 )
-
-        z1 = 2*c*h/( rt+1 )
-        z2 = c**3 * h**3 * (k+1)/( rt * (rt+1)**2 )
-        
-        z_pol = 0.0
-        for i, A in enumerate(self.coefs):
-            z_pol += (2*(i+1)+2) * A * h**(2*(i+1)+1)
-        
-        return (z1 + z2 + z_pol)
+    type = 'ASP'
 
-    def deriv_2nd(self, h):
-        c = self.c
-        k = self.k
-        rt = np.sqrt( 1 - (1+k) * c**2 * h**2 )
-
-        z1 = 2*c/(rt+1)
-        z2 = 5 * c**3 * h**2 * (k+1)/( rt * (rt+1)**2 )
-        z3 = c**5 * h**4 * (k+1)**2 / ( rt**3 * (rt+1)**2 )
-        z4 = - 2 * c**5 * h**4 * (k+1)**2 / ( (c**2 * h**2 * (k+1) -1) * (rt+1)**3 )
-        
-        z_pol = 0.0
-        for i, A in enumerate(self.coefs):
-            z_pol += (2*(i+1)+1)*(2*(i+1)+2) * A * h**(2*(i+1))
-        
-        return (z1+z2+z3+z4+z_pol)
+    def evaluate(self, h, order=2):
+        # A4*h^4 + A6*h^6 + ... is a polynomial in h^2
+        conic = _conic(self.c, self.k, h, order)
+        pol = _polynomial(self.coefs, h, order, 4, 2)
+        return tuple(zc + zp for zc, zp in zip(conic, pol))
+    
 
-    def slope(self, h):
-        return (np.arctan(self.deriv_1st(h)))*180/np.pi
+class OddAsphere(_Asphere):
+    __slots__ = ()
+
+    type = 'ODD'
 
-    def local_curvature(self, h):
-        return self.deriv_2nd(h) / np.power( (1 + self.deriv_1st(h)**2), 3/2)
+    def evaluate(self, h, order=2):
+        # A3*h^3 + A4*h^4 + ...
+        conic = _conic(self.c, self.k, h, order)
+        pol = _polynomial(self.coefs, h, order, 3, 1)
+        return tuple(zc + zp for zc, zp in zip(conic, pol))
 
-    def local_radius(self, h):
-        try:
-            lr = 1/self.local_curvature(h)
-        except ZeroDivisionError:
-            pass
 
-        return lr
-    
+class EvaluationCache:
+    """
+    Bounded LRU cache of surface evaluation results
 
-class OddAsphere(Surface):
-    def __init__(self, r=np.inf, k=0.0, coefs=None, inner_d=0.0, outer_d=0.0):
-        super().__init__(inner_d, outer_d)
-        self.type = 'ODD'
+    Results are keyed on the surface parameters (see Surface.profile_key)
+    and the height grid, so an unchanged surface evaluated on the same grid
+    is returned without recomputation. The arrays handed out are read-only
+    since they are shared between callers. The cache may be used from
+    several threads; evaluation itself runs outside of its lock.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, name, surf, h, compute):
+        h = np.asarray(h, dtype=float)
+        key = (name, surf.profile_key(), h.shape, h.tobytes())
+
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return result
+            self.misses += 1
+
+        result = tuple(np.asarray(z) for z in compute(h))
+        for z in result:
+            z.setflags(write=False)
+
+        with self._lock:
+            self._results[key] = result
+            if len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+
+        return result
+
+    def evaluate(self, surf, h, order=2):
+        """ cached surf.evaluate(h, order)
+        """
+        return self._lookup('evaluate', surf, h, lambda hh: surf.evaluate(hh, 2))[:order+1]
 
-        self.r = r
-        self.k = k
+    def profile(self, surf, h):
+        """ cached surf.profile(h)
+        """
+        return self._lookup('profile', surf, h, surf.profile)
+
+    def sag(self, surf, h):
+        return self.evaluate(surf, h, 0)[0]
+
+    def info(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'maxsize': self.maxsize, 'currsize': len(self._results)}
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# shared by the GUI and batch scripts
+evaluation_cache = EvaluationCache()
+
+
+class SurfaceBatch:
+    """
+    Struct-of-arrays container for evaluating many surfaces at once
+
+    The parameters of N surfaces are packed column-wise into contiguous
+    arrays, coefficients padded with zeros to a (N, M) array. Heights are
+    given either as a 1-D array shared by all surfaces or as a 2-D array
+    with one row per surface, and every result has one row per surface.
+    """
+
+    types = ('SPH', 'ASP', 'ODD')
+
+    def __init__(self, kind, r, k=None, coefs=None, n_coefs=None, inner_d=None, outer_d=None):
+        # columns are always copied, so writing a batch never reaches the
+        # caller's arrays or the batch it was sliced from
+        self.kind = np.array(kind, dtype=np.int8)
+        n = len(self.kind)
+
+        self.r = _column(r, n, np.inf)
+        self.k = _column(k, n, 0.0)
+        self.inner_d = _column(inner_d, n, 0.0)
+        self.outer_d = _column(outer_d, n, 0.0)
 
         if coefs is None:
-            self.coefs = np.zeros(9,dtype=float)
+            coefs = np.zeros((n, 0), dtype=float)
+        coefs = np.array(coefs, dtype=float)
+        if coefs.ndim == 2:
+            self.coefs = coefs.reshape(n, coefs.shape[1])
+        elif n == 0:
+            # -1 cannot be inferred for zero rows
+            self.coefs = coefs.reshape(0, 0)
         else:
-            self.coefs = coefs
-    
-    def sag(self, h):
-        z_conic = self.c*np.power(h,2.0) /(1.0 + np.sqrt(1-(1+self.k)*np.power(self.c,2.0)*np.power(h,2.0)))
+            self.coefs = coefs.reshape(n, -1)
 
-        z_pol = 0.0
-        for i, A in enumerate(self.coefs):
-            z_pol += A*h**(i+3)
+        if n_coefs is None:
+            self.n_coefs = np.full(n, self.coefs.shape[1], dtype=np.int32)
+        else:
+            self.n_coefs = np.array(n_coefs, dtype=np.int32)
 
-        return (z_conic + z_pol)
+    @property
+    def c(self):
+        """ curvatures, derived from r so they follow writes to it
+        """
+        with np.errstate(divide='ignore'):
+            return 1/self.r
+
+    @classmethod
+    def from_surfaces(cls, surfaces):
+        """
+        Packs a list of Sphere/EvenAsphere/OddAsphere into a batch
+        """
+        n = len(surfaces)
+        n_coefs = np.zeros(n, dtype=np.int32)
+        for i, surf in enumerate(surfaces):
+            if surf.type != 'SPH':
+                n_coefs[i] = len(surf.coefs)
+
+        coefs = np.zeros((n, n_coefs.max(initial=0)), dtype=float)
+        for i, surf in enumerate(surfaces):
+            if n_coefs[i] > 0:
+                coefs[i, :n_coefs[i]] = surf.coefs
+
+        return cls(kind=[cls.types.index(surf.type) for surf in surfaces],
+                   r=[surf.r for surf in surfaces],
+                   k=[getattr(surf, 'k', 0.0) for surf in surfaces],
+                   coefs=coefs,
+                   n_coefs=n_coefs,
+                   inner_d=[surf.inner_d for surf in surfaces],
+                   outer_d=[surf.outer_d for surf in surfaces])
+
+    def __len__(self):
+        return len(self.kind)
+
+    def __getitem__(self, index):
+        if np.ndim(index) == 0 and not isinstance(index, slice):
+            return self._surface(int(index))
+
+        return SurfaceBatch(kind=self.kind[index],
+                            r=self.r[index],
+                            k=self.k[index],
+                            coefs=self.coefs[index],
+                            n_coefs=self.n_coefs[index],
+                            inner_d=self.inner_d[index],
+                            outer_d=self.outer_d[index])
+
+    def _surface(self, i):
+        surf_type = self.types[self.kind[i]]
+        if surf_type == 'SPH':
+            return Sphere(self.r[i], self.inner_d[i], self.outer_d[i])
+
+        if surf_type == 'ASP':
+            cls = EvenAsphere
+        else:
+            cls = OddAsphere
+        return cls(self.r[i], self.k[i], self.coefs[i, :self.n_coefs[i]],
+                   self.inner_d[i], self.outer_d[i])
+
+    def __setitem__(self, i, surf):
+        """ replaces the i-th surface, widening the coefficients if needed
+        """
+        n = 0 if surf.type == 'SPH' else len(surf.coefs)
+        if n > self.coefs.shape[1]:
+            pad = np.zeros((len(self), n - self.coefs.shape[1]))
+            self.coefs = np.ascontiguousarray(np.concatenate((self.coefs, pad), axis=1))
+
+        self.kind[i] = self.types.index(surf.type)
+        self.r[i] = surf.r
+        self.k[i] = getattr(surf, 'k', 0.0)
+        self.coefs[i] = 0.0
+        self.coefs[i, :n] = surf.coefs if n > 0 else ()
+        self.n_coefs[i] = n
+        self.inner_d[i] = surf.inner_d
+        self.outer_d[i] = surf.outer_d
+
+    def to_surfaces(self):
+        return [self._surface(i) for i in range(len(self))]
+
+    @classmethod
+    def concatenate(cls, batches):
+        """
+        Joins batches into one, padding the coefficients to the widest
+        """
+        batches = list(batches)
+        if len(batches) == 0:
+            return cls(kind=[], r=[])
+        m = max(b.coefs.shape[1] for b in batches)
+
+        def join(name):
+            return np.concatenate([getattr(b, name) for b in batches])
+
+        coefs = np.concatenate([np.pad(b.coefs, ((0, 0), (0, m - b.coefs.shape[1])))
+                                for b in batches])
+
+        return cls(kind=join('kind'), r=join('r'), k=join('k'), coefs=coefs,
+                   n_coefs=join('n_coefs'), inner_d=join('inner_d'),
+                   outer_d=join('outer_d'))
+
+    def _heights(self, h):
+        h = np.asarray(h, dtype=float)
+        if h.ndim < 2:
+            h = np.broadcast_to(np.atleast_1d(h), (len(self), h.size))
+        return h
+
+    def evaluate(self, h, order=2):
+        """
+        Computes sag and its derivatives for all surfaces together
+
+        Args:
+            h: heights, 1-D array shared by all surfaces or (N, M) array
+            order(int): highest derivative to compute (0, 1 or 2)
+
+        Returns:
+            tuple of (N, M) arrays of sag, 1st and 2nd derivative
+        """
+        h = self._heights(h)
+        terms = _conic(self.c[:, np.newaxis], self.k[:, np.newaxis], h, order)
+
+        # polynomial terms only for the rows of each asphere type
+        for kind, p0, step in ((1, 4, 2), (2, 3, 1)):
+            rows = np.flatnonzero(self.kind == kind)
+            if len(rows) == 0:
+                continue
+            pol = _polynomial(self.coefs[rows], h[rows], order, p0, step)
+            for z, zp in zip(terms, pol):
+                z[rows] += zp
+
+        return tuple(terms)
+
+    def sag(self, h):
+        return self.evaluate(h, 0)[0]
 
     def deriv_1st(self, h):
-        c = self.c
-        k = self.k
-        rt = np.sqrt( 1 - (1+k) * c**2 * h**2 )
-
-        z1 = 2*c*h/( rt+1 )
-        z2 = c**3 * h**3 * (k+1)/( rt * (rt+1)**2 )
-        
-        z_pol = 0.0
-        for i, A in enumerate(self.coefs):
-            z_pol += (i+3) * A * h**(i+2)
-        
-        return (z1 + z2 + z_pol)
+        return self.evaluate(h, 1)[1]
 
     def deriv_2nd(self, h):
-        c = self.c
-        k = self.k
-        rt = np.sqrt( 1 - (1+k) * c**2 * h**2 )
-
-        z1 = 2*c/(rt+1)
-        z2 = 5 * c**3 * h**2 * (k+1)/( rt * (rt+1)**2 )
-        z3 = c**5 * h**4 * (k+1)**2 / ( rt**3 * (rt+1)**2 )
-        z4 = - 2 * c**5 * h**4 * (k+1)**2 / ( (c**2 * h**2 * (k+1) -1) * (rt+1)**3 )
-        
-        z_pol = 0.0
-        for i,A in enumerate(self.coefs):
-            z_pol += (i+2)*(i+3)*A*h**(i+1)
-        
-        return (z1+z2+z3+z4+z_pol)
+        return self.evaluate(h, 2)[2]
 
     def slope(self, h):
-        return (np.arctan(self.deriv_1st(h)))*180/np.pi
-    
+        return self.profile(h)[1]
+
     def local_curvature(self, h):
-        return self.deriv_2nd(h) / np.power( (1 + self.deriv_1st(h)**2), 3/2)
+        with np.errstate(divide='ignore'):
+            return 1/self.local_radius(h)
 
     def local_radius(self, h):
-        try:
-            lr = 1/self.local_curvature(h)
-        except ZeroDivisionError:
-            pass
-
-        return lr
-
+        return self.profile(h)[2]
+
+    def profile(self, h):
+        """
+        Returns sag, slope and local radius from a single evaluation
+
+        Spheres use their closed forms, the other surfaces evaluate().
+        """
+        h = self._heights(h)
+        z = np.empty(h.shape)
+        slope = np.empty(h.shape)
+        local_r = np.empty(h.shape)
+
+        sph = np.flatnonzero(self.kind == 0)
+        c = self.c[sph, np.newaxis]
+        z[sph] = _conic(c, 0.0, h[sph], 0)[0]
+        slope[sph] = _sphere_slope(c, h[sph])
+        local_r[sph] = self.r[sph, np.newaxis]
+
+        asp = np.flatnonzero(self.kind != 0)
+        if len(asp) > 0:
+            z[asp], z1, z2 = self[asp].evaluate(h[asp], 2)
+            slope[asp] = _slope(z1)
+            local_r[asp] = _local_radius(z1, z2)
+
+        return z, slope, local_r
+
+    def _aperture_grid(self, semi_aperture, n):
+        if semi_aperture is None:
+            semi_aperture = self.inner_d/2
+        a = np.broadcast_to(np.asarray(semi_aperture, dtype=float), (len(self),))
+        return a[:, np.newaxis]*np.linspace(0.0, 1.0, n)
+
+    def best_fit_sphere(self, semi_aperture=None, n=256):
+        """
+        Least-squares best-fit spheres
+
+        The sphere is fitted to the profile on n heights up to the semi
+        aperture (inner_d/2 by default) by minimizing the algebraic
+        residual weighted by height for an area average. Its vertex may be
+        shifted along the axis.
+
+        Returns:
+            arrays of radius and vertex position of the spheres
+        """
+        h = self._aperture_grid(semi_aperture, n)
+        c, z0 = _best_fit_sphere(h, self.sag(h), h)
+        with np.errstate(divide='ignore'):
+            return 1/c, z0
+
+    def departure(self, h, semi_aperture=None, n=256):
+        """
+        Departure of each surface from its best-fit sphere
+
+        Returns:
+            (N, M) array of sag minus best-fit sphere
+        """
+        radius, z0 = self.best_fit_sphere(semi_aperture, n)
+        h = self._heights(h)
+        c = 1/radius[:, np.newaxis]
+
+        return self.sag(h) - z0[:, np.newaxis] - _conic(c, 0.0, h, 0)[0]
+
+    def departure_metrics(self, semi_aperture=None, n=256):
+        """
+        Asphericity of each surface over the aperture
+
+        Returns:
+            dict of arrays: 'radius' and 'z0' of the best-fit sphere, 'pv'
+            of the departure and 'max_slope', the largest slope of the
+            departure
+        """
+        radius, z0 = self.best_fit_sphere(semi_aperture, n)
+        h = self._aperture_grid(semi_aperture, n)
+        c = 1/radius[:, np.newaxis]
+
+        z, z1 = self.evaluate(h, 1)
+        zs, zs1 = _conic(c, 0.0, h, 1)
+        d = z - z0[:, np.newaxis] - zs
+
+        return {'radius': radius,
+                'z0': z0,
+                'pv': d.max(axis=1) - d.min(axis=1),
+                'max_slope': np.abs(z1 - zs1).max(axis=1)}
+
+    def max_semi_aperture(self, max_slope=None, h_search=None, n_probe=257):
+        """
+        Largest valid height of each surface, see Surface.max_semi_aperture
+        """
+        if h_search is None:
+            h_search = self.outer_d/2
+        h_search = np.broadcast_to(np.asarray(h_search, dtype=float), (len(self),))
+        h_max = np.empty(len(self))
+
+        sph = np.flatnonzero(self.kind == 0)
+        h_max[sph] = _sphere_semi_aperture(self.c[sph], h_search[sph], max_slope)
+
+        asp = np.flatnonzero(self.kind != 0)
+        if len(asp) > 0:
+            batch = self[asp]
+            h_max[asp] = _max_semi_aperture(batch.evaluate, batch.c, batch.k,
+                                            h_search[asp], max_slope, n_probe)
+
+        return h_max
+
+    def inverse_sag(self, z, h_max=None, iterations=20, tol=1e-12):
+        """
+        Heights where each surface reaches the sag z
+
+        Args:
+            z: sags, 1-D array shared by all surfaces or (N, M) array
+            h_max: upper end of the searched range per surface, inner_d/2 by default
+
+        Returns:
+            (N, M) array of heights, nan where z is not reached
+        """
+        if h_max is None:
+            h_max = self.inner_d/2
+        h_max = np.broadcast_to(np.asarray(h_max, dtype=float), (len(self),))
+        h_max = np.where(h_max > 0, h_max, np.nan)[:, np.newaxis]
+        z = self._heights(z)
+        h = np.empty(z.shape)
+
+        sph = np.flatnonzero(self.kind == 0)
+        h[sph] = _sphere_inverse_sag(self.c[sph, np.newaxis], z[sph], h_max[sph])
+
+        asp = np.flatnonzero(self.kind != 0)
+        if len(asp) > 0:
+            batch = self[asp]
+            h[asp] = _inverse_sag(batch.evaluate, z[asp], batch.c[:, np.newaxis],
+                                  batch.k[:, np.newaxis], h_max[asp], iterations, tol)
+
+        return h
+
+def _symmetric(x):
+    # mirrored only up to the rounding of linspace, so the mirrored
+    # half is exact to the last few bits of the extent
+    return bool(np.all(np.abs(x + x[::-1]) <= 8*np.finfo(float).eps*np.abs(x).max()))
+
+
+def _column(values, n, default):
+    if values is None:
+        return np.full(n, default, dtype=float)
+    values = np.asarray(values, dtype=float)
+    return np.array(np.broadcast_to(values, (n,)))
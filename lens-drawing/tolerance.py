@@ -0,0 +1,178 @@
+""" Module for Monte Carlo tolerance analysis of lenses
+"""
+
+"""
+    Copyright (C) 2020 Hiiragi <heterophyllus.work@gmail.com>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import surface as s
+from lens import Lens, LensTable, edge_thicknesses, volumes
+
+
+# tolerances perturbing the lens, as (lower, upper) offsets from nominal
+perturbations = ('thickness', 'mech_diameter', 'radius1', 'radius2')
+
+# tolerances checked against the perturbed lens
+specifications = ('koba',)
+
+metrics = ('thickness', 'outer_d', 'radius1', 'radius2', 'koba', 'volume', 'sag1', 'sag2')
+
+
+def simulate(lens, tolerances=None, n=100000, seed=None, distribution='uniform',
+             chunk_size=100000, processes=None):
+    """
+    Draws perturbed copies of a lens and evaluates them all at once
+
+    The tolerances are given as in Singlet.tolerances: thickness,
+    mech_diameter (the outer diameter of both surfaces), radius1 and
+    radius2 perturb the lens, and koba is the allowed range of the edge
+    thickness at the outer diameter around its nominal value. Samples are
+    drawn uniformly within the ranges, or for 'normal' with the range as
+    +/- 3 sigma around its center.
+
+    Args:
+        lens: Lens, or Singlet of the notebooks
+        tolerances(dict): name -> (lower, upper), lens.tolerances if None
+        n(int): number of samples
+        seed: seed of the random generator
+        distribution(str): 'uniform' or 'normal'
+        chunk_size(int): number of samples evaluated at a time
+        processes(int): number of worker processes, in-process if None
+
+    Returns:
+        dict of sample arrays: the perturbed thickness, outer_d, radius1
+        and radius2, edge thickness 'koba', 'volume', sags 'sag1' and
+        'sag2' at the clear apertures, and 'ok' where koba is within
+        its tolerance
+    """
+    if tolerances is None:
+        tolerances = lens.tolerances
+    unknown = set(tolerances) - set(perturbations) - set(specifications)
+    if unknown:
+        raise ValueError("unknown tolerances: {}".format(', '.join(sorted(unknown))))
+    if distribution not in ('uniform', 'normal'):
+        raise ValueError("unknown distribution: {}".format(distribution))
+
+    dct = _as_lens(lens).to_dict()
+    sizes = [min(chunk_size, n - i) for i in range(0, n, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = ([dct]*len(sizes), [tolerances]*len(sizes), sizes, seeds, [distribution]*len(sizes))
+
+    if processes is None or len(sizes) <= 1:
+        parts = list(map(_simulate_chunk, *args))
+    else:
+        with ProcessPoolExecutor(processes) as executor:
+            parts = list(executor.map(_simulate_chunk, *args))
+
+    if len(parts) == 0:
+        parts = [_simulate_chunk(dct, tolerances, 0, np.random.SeedSequence(seed), distribution)]
+
+    return {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+
+
+def statistics(samples, percentiles=(1, 5, 50, 95, 99)):
+    """
+    Yield and percentile statistics of simulated samples
+
+    Returns:
+        dict with 'yield', the fraction of samples within the tolerances,
+        'count', and per metric a dict of 'mean', 'std', 'min', 'max' and
+        'percentiles' mapping each percentile to its value
+    """
+    stats = {'count': len(samples['ok']),
+             'yield': float(np.mean(samples['ok'])) if len(samples['ok']) > 0 else np.nan}
+
+    for key in metrics:
+        values = samples[key][np.isfinite(samples[key])]
+        if len(values) == 0:
+            stats[key] = {'mean': np.nan, 'std': np.nan, 'min': np.nan, 'max': np.nan,
+                          'percentiles': {p: np.nan for p in percentiles}}
+            continue
+        stats[key] = {'mean': values.mean(),
+                      'std': values.std(),
+                      'min': values.min(),
+                      'max': values.max(),
+                      'percentiles': dict(zip(percentiles, np.percentile(values, percentiles)))}
+
+    return stats
+
+
+def _as_lens(lens):
+    if isinstance(lens, Lens):
+        return lens
+
+    # Singlet of the notebooks, spheres with one mechanical diameter
+    left = s.Sphere(lens.left_surface.radius, lens.left_surface.clear_diameter, lens.mech_diameter)
+    right = s.Sphere(lens.right_surface.radius, lens.right_surface.clear_diameter, lens.mech_diameter)
+    return Lens(left, right, thickness=lens.thickness, material=lens.material)
+
+
+def _draw(rng, bounds, n, distribution):
+    lo, hi = bounds
+    if distribution == 'normal':
+        return rng.normal((lo + hi)/2, (hi - lo)/6, n)
+    return rng.uniform(lo, hi, n)
+
+
+def _replicate(surf, n, dr, dd):
+    batch = s.SurfaceBatch.from_surfaces([surf])
+    return s.SurfaceBatch(kind=np.repeat(batch.kind, n),
+                          r=batch.r[0] + dr,
+                          k=batch.k[0],
+                          coefs=np.repeat(batch.coefs, n, axis=0),
+                          n_coefs=np.repeat(batch.n_coefs, n),
+                          inner_d=batch.inner_d[0],
+                          outer_d=batch.outer_d[0] + dd)
+
+
+def _evaluate(table):
+    left, right = table.left, table.right
+    r_min = np.minimum(left.outer_d, right.outer_d)/2
+
+    return {'thickness': table.thickness,
+            'outer_d': np.maximum(left.outer_d, right.outer_d),
+            'radius1': left.r,
+            'radius2': right.r,
+            'koba': edge_thicknesses(table, r_min[:, np.newaxis])[:, 0],
+            'volume': volumes(table),
+            'sag1': left.sag(left.inner_d[:, np.newaxis]/2)[:, 0],
+            'sag2': right.sag(right.inner_d[:, np.newaxis]/2)[:, 0]}
+
+
+def _simulate_chunk(dct, tolerances, n, seed, distribution):
+    lens = Lens()
+    lens.from_dict(dct)
+    rng = np.random.default_rng(seed)
+
+    offsets = {key: np.zeros(n) for key in perturbations}
+    for key in perturbations:
+        if key in tolerances:
+            offsets[key] = _draw(rng, tolerances[key], n, distribution)
+
+    left = _replicate(lens.left, n, offsets['radius1'], offsets['mech_diameter'])
+    right = _replicate(lens.right, n, offsets['radius2'], offsets['mech_diameter'])
+    samples = _evaluate(LensTable(left, right, lens.thickness + offsets['thickness']))
+
+    nominal = _evaluate(LensTable.from_lenses([lens]))['koba'][0]
+    lo, hi = tolerances.get('koba', (-np.inf, np.inf))
+    koba = samples['koba']
+    with np.errstate(invalid='ignore'):
+        samples['ok'] = (koba > 0) & (koba >= nominal + lo) & (koba <= nominal + hi)
+
+    return samples
@@ -17,6 +17,17 @@ class Surface:
         else:
             return 1.0/self.radius
 
+    def sample(self, h_min:float, h_max:float, tolerance:float=0.001) -> np.ndarray:
+        # chord of an arc with angle dt deviates r*(1-cos(dt/2)) from it
+        if self.curvature == 0.0:
+            return np.array([h_min, h_max])
+        r = abs(self.radius)
+        dt = 2*np.arccos(max(1 - tolerance/r, -1.0))
+        t0 = np.arcsin(h_min/r)
+        t1 = np.arcsin(h_max/r)
+        n = max(1, int(np.ceil((t1-t0)/dt)))
+        return r*np.sin(np.linspace(t0, t1, n+1))
+
 
 class Singlet:
     def __init__(self, radius1:float, clear_diameter1:float, radius2:float, clear_diameter2:float, mech_diameter:float, material:str, thickness:float):
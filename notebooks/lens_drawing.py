@@ -14,6 +14,7 @@ class LensDrawing:
         
         self.with_dimension = True
         self.lineweight = 25
+        self.profile_tolerance = None # chordal tolerance to draw surfaces as polylines instead of arcs
         self.structure_layer = 'structure'
         self.dimension_layer = 'dimension'
 
@@ -31,9 +32,17 @@ class LensDrawing:
         
         # draw curved surface
         left_pos = pos
-        left_arc = self.add_arc(left_pos, r1, cd1)
         right_pos = (pos[0]+t, pos[1] )
-        right_arc = self.add_arc(right_pos, r2, cd2)
+        if self.profile_tolerance is None:
+            left_arc = self.add_arc(left_pos, r1, cd1)
+            right_arc = self.add_arc(right_pos, r2, cd2)
+            left_ends = (left_arc.start_point, left_arc.end_point)
+            right_ends = (right_arc.start_point, right_arc.end_point)
+        else:
+            self.add_profile(left_pos, lens.left_surface, cd1, self.profile_tolerance)
+            self.add_profile(right_pos, lens.right_surface, cd2, self.profile_tolerance)
+            left_ends = self.profile_ends(left_pos, lens.left_surface, cd1)
+            right_ends = self.profile_ends(right_pos, lens.right_surface, cd2)
     
         # draw flat surface
         left_x = left_pos[0]+lens.left_surface.sag(cd1/2)
@@ -79,11 +88,11 @@ class LensDrawing:
             thresh = 0.01
             # inner diameter left
             if abs(mech_d - cd1) > thresh:
-                self.add_dim(p1= left_arc.end_point, p2=left_arc.start_point, distance= -10)
+                self.add_dim(p1= left_ends[1], p2=left_ends[0], distance= -10)
 
             # inner diameter right
             if abs(mech_d - cd2) > thresh:
-                self.add_dim(p1= right_arc.start_point, p2=right_arc.end_point, distance= 10)
+                self.add_dim(p1= right_ends[0], p2=right_ends[1], distance= 10)
 
             # outer diameter
             self.add_dim(p1=upper_koba_pt1, p2=lower_koba_pt1, distance=20, tolerance=lens.tolerances["mech_diameter"])
@@ -125,6 +134,30 @@ class LensDrawing:
 
         return new_arc
 
+    def add_profile(self, vertex_pt, surface, diameter, tolerance:float= 0.001):
+        # polyline of any surface profile, points spaced by surface.sample()
+        h = surface.sample(-diameter/2, diameter/2, tolerance)
+        z = surface.sag(h)
+        points = np.column_stack((vertex_pt[0]+z, vertex_pt[1]+h))
+
+        new_polyline = self.msp.add_lwpolyline(
+            points,
+            format='xy',
+            dxfattribs={'layer':'structure','lineweight':self.lineweight})
+
+        return new_polyline
+
+    def profile_ends(self, vertex_pt, surface, diameter):
+        # start and end points in the order add_arc() would draw them
+        h = diameter/2
+        x = vertex_pt[0]+surface.sag(h)
+        upper = (x, vertex_pt[1]+h)
+        lower = (x, vertex_pt[1]-h)
+        if surface.radius > 0:
+            return upper, lower
+        else:
+            return lower, upper
+
     def add_dim(self, p1, p2, distance, tolerance:tuple= None):
         dim = self.msp.add_aligned_dim(
             p1=p1, 